@@ -1,21 +1,59 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from datetime import datetime
 from io import BytesIO
 import os
 import json
 import hashlib
+import threading
 from collections import OrderedDict
-from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
 import re
 
 import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
+try:
+    import python_calamine  # noqa: F401
+
+    _HAS_CALAMINE = True
+except ImportError:  # pragma: no cover - depende del entorno
+    _HAS_CALAMINE = False
+
+try:
+    import pyarrow  # noqa: F401
+
+    # Texto respaldado por Arrow: strip/lower/contains se ejecutan en kernels nativos.
+    _STRING_DTYPE = "string[pyarrow]"
+except ImportError:  # pragma: no cover - depende del entorno
+    _STRING_DTYPE = "string"
+
+try:
+    import numexpr
+
+    _HAS_NUMEXPR = True
+except ImportError:  # pragma: no cover - depende del entorno
+    _HAS_NUMEXPR = False
+
+try:
+    import orjson
+
+    def _json_dumps(value) -> str:
+        return orjson.dumps(value).decode()
+
+    _json_loads = orjson.loads
+except ImportError:  # pragma: no cover - depende del entorno
+    def _json_dumps(value) -> str:
+        return json.dumps(value, ensure_ascii=True)
+
+    _json_loads = json.loads
 
 
 logger = logging.getLogger(__name__)
@@ -34,14 +72,10 @@ MONTH_MAP = {
     "dic": 12,
 }
 
-MONTH_REGEXES = [
-    # ene 2024, ene-2024, ene_2024
-    re.compile(r"^(?P<mon>ene|feb|mar|abr|may|jun|jul|ago|sep|oct|nov|dic)\s*[-_/]?\s*(?P<year>20\d{2})$", re.IGNORECASE),
-    # 2024 ene, 2024-ene
-    re.compile(r"^(?P<year>20\d{2})\s*[-_/]?\s*(?P<mon>ene|feb|mar|abr|may|jun|jul|ago|sep|oct|nov|dic)$", re.IGNORECASE),
-    # ene 24
-    re.compile(r"^(?P<mon>ene|feb|mar|abr|may|jun|jul|ago|sep|oct|nov|dic)\s*[-_/]?\s*(?P<year>\d{2})$", re.IGNORECASE),
-]
+# Todo lo que sigue al primer ":" de "Grupo: Hotel"; un único reemplazo en vez de split + [0].
+_CLUSTER_SUFFIX = r"(?s):.*"
+
+COUNTRY_COLUMNS = ["País", "Pais", "Country", "Hotel Country", "Hotel Country "]
 
 MONTH_NAME = {
     1: "ene",
@@ -65,6 +99,15 @@ class MonthColumn:
     month: int
     year: int
     date: datetime
+    # Derivados una sola vez al detectar la columna: ordinal entero y claves "YYYY-MM".
+    ordinal: int = field(init=False)
+    key: str = field(init=False)
+    prev_key: str = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.ordinal = self.year * 12 + self.month
+        self.key = f"{self.year:04d}-{self.month:02d}"
+        self.prev_key = f"{self.year - 1:04d}-{self.month:02d}"
 
 
 @dataclass
@@ -78,100 +121,216 @@ class AnalysisError(Exception):
     pass
 
 
-_EXCEL_CACHE = OrderedDict()
-_EXCEL_CACHE_MAX = 4
+@dataclass
+class ParsedWorkbook:
+    df: pd.DataFrame
+    month_cols: List[MonthColumn]
+    available_months: List[Dict]
+    country_col: Optional[str]
+    search_hay: pd.Series
+    # Intermedios que solo dependen del fichero: matriz de meses (solo lectura), posiciones y año anterior.
+    month_matrix: np.ndarray
+    col_pos: Dict[str, int]
+    prev_of: Dict[str, Optional[MonthColumn]]
+
 
+_EXCEL_CACHE: "OrderedDict[bytes, ParsedWorkbook]" = OrderedDict()
+_EXCEL_CACHE_MAX = 8
+
+
+def _file_key(file_bytes: bytes) -> bytes:
+    return hashlib.blake2b(file_bytes, digest_size=16).digest()
 
-def _excel_cache_get(file_bytes: bytes) -> Optional[pd.DataFrame]:
-    key = hashlib.md5(file_bytes).hexdigest()
-    cached = _EXCEL_CACHE.get(key)
-    if cached is None:
-        return None
-    _EXCEL_CACHE.move_to_end(key)
-    return cached.copy(deep=True)
 
+# Las peticiones de FastAPI corren en un pool de hilos: el LRU y el parseo por fichero se protegen con locks.
+_EXCEL_CACHE_LOCK = threading.Lock()
+# Lock de parseo por contenido y número de hilos que lo usan; la entrada se borra al quedar sin usuarios.
+_PARSE_LOCKS: Dict[bytes, List] = {}
 
-def _excel_cache_set(file_bytes: bytes, df: pd.DataFrame) -> None:
-    key = hashlib.md5(file_bytes).hexdigest()
-    _EXCEL_CACHE[key] = df
-    _EXCEL_CACHE.move_to_end(key)
-    while len(_EXCEL_CACHE) > _EXCEL_CACHE_MAX:
-        _EXCEL_CACHE.popitem(last=False)
+
+def _excel_cache_get(key: bytes) -> Optional[ParsedWorkbook]:
+    with _EXCEL_CACHE_LOCK:
+        cached = _EXCEL_CACHE.get(key)
+        if cached is None:
+            return None
+        _EXCEL_CACHE.move_to_end(key)
+        return cached
+
+
+def _excel_cache_set(key: bytes, parsed: ParsedWorkbook) -> None:
+    with _EXCEL_CACHE_LOCK:
+        _EXCEL_CACHE[key] = parsed
+        _EXCEL_CACHE.move_to_end(key)
+        while len(_EXCEL_CACHE) > _EXCEL_CACHE_MAX:
+            _EXCEL_CACHE.popitem(last=False)
+
+
+@contextmanager
+def _parse_lock(key: bytes) -> Iterator[None]:
+    with _EXCEL_CACHE_LOCK:
+        entry = _PARSE_LOCKS.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        # Solo el último hilo en salir borra la entrada: los que esperan siguen compartiendo el mismo lock,
+        # y un parseo fallido no deja el lock para siempre.
+        with _EXCEL_CACHE_LOCK:
+            entry[1] -= 1
+            if not entry[1]:
+                del _PARSE_LOCKS[key]
+
+
+_HEADER_SCAN_ROWS = 15
+_OPENPYXL_READ_KWARGS = {"read_only": True, "data_only": True, "keep_links": False}
 
 
 def _detect_header_row(df_head: pd.DataFrame) -> Optional[int]:
-    for idx in range(min(15, len(df_head))):
+    for idx in range(min(_HEADER_SCAN_ROWS, len(df_head))):
         row = df_head.iloc[idx]
         if row.astype(str).str.strip().str.lower().eq("cliente").any():
             return idx
     return None
 
 
-def _read_excel(file_bytes: bytes, filename: str) -> pd.DataFrame:
-    cached_df = _excel_cache_get(file_bytes)
-    if cached_df is not None:
-        return cached_df
+def _engine_kwargs(engine: str) -> Dict:
+    # openpyxl en modo read_only/data_only evita construir estilos y objetos de celda completos.
+    return dict(_OPENPYXL_READ_KWARGS) if engine == "openpyxl" else {}
+
+
+_ID_COLUMNS = frozenset(["Cliente", "Hotel - Code", "Ubicación", *COUNTRY_COLUMNS])
+
+
+def _is_relevant_column(name) -> bool:
+    return name in _ID_COLUMNS or _parse_month_column(name) is not None
+
+
+def _frame_from_header_row(raw: pd.DataFrame, header_row: int) -> pd.DataFrame:
+    if header_row >= len(raw):
+        return pd.DataFrame()
 
+    # Mismos nombres que pd.read_excel(header=...): "Unnamed: i" para vacíos y sufijos ".n" para duplicados.
+    names: List = []
+    counts: Dict = {}
+    for idx, value in enumerate(raw.iloc[header_row].tolist()):
+        name = f"Unnamed: {idx}" if pd.isna(value) else value
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        counts[name] = count + 1
+        names.append(name)
+
+    # Solo se conservan las columnas que usa el análisis (identificación, ubicación/país y meses):
+    # el resto de columnas de la plantilla no pasa por infer_objects ni ocupa la caché.
+    keep = [idx for idx, name in enumerate(names) if _is_relevant_column(name)]
+    df = raw.iloc[header_row + 1 :, keep].reset_index(drop=True)
+    df.columns = [names[idx] for idx in keep]
+    return df.infer_objects()
+
+
+def _frame_from_records(df: pd.DataFrame) -> pd.DataFrame:
+    # Mismo recorte de columnas que _frame_from_header_row para frames que ya traen cabecera.
+    keep = [col for col in df.columns if _is_relevant_column(col)]
+    return df[keep].reset_index(drop=True).infer_objects()
+
+
+def _read_excel(file_bytes: bytes, filename: str) -> pd.DataFrame:
     ext = filename.lower().split(".")[-1]
     engine = None
     if ext == "xls":
         engine = "xlrd"
     elif ext == "xlsx":
-        engine = "openpyxl"
+        # calamine (Rust) parsea xlsx mucho más rápido; openpyxl queda como respaldo.
+        engine = "calamine" if _HAS_CALAMINE else "openpyxl"
 
     if engine is None:
         raise AnalysisError("Formato no soportado. Usa .xls o .xlsx")
 
     try:
-        # Only sample first rows to detect header and avoid a full initial parse.
-        preview = pd.read_excel(BytesIO(file_bytes), engine=engine, header=None, nrows=30)
+        # Single parse without header; the header row is located and sliced in memory.
+        raw = pd.read_excel(BytesIO(file_bytes), engine=engine, header=None, engine_kwargs=_engine_kwargs(engine))
     except Exception:
         # If extension lies (e.g., .xls but actually xlsx), fallback to openpyxl.
         if engine != "openpyxl":
-            preview = pd.read_excel(BytesIO(file_bytes), engine="openpyxl", header=None, nrows=30)
             engine = "openpyxl"
+            raw = pd.read_excel(BytesIO(file_bytes), engine=engine, header=None, engine_kwargs=_engine_kwargs(engine))
         else:
             raise
-    header_row = _detect_header_row(preview)
+    header_row = _detect_header_row(raw)
     if header_row is None:
         # Fallback to old format that starts at row 7 (index 6)
         header_row = 6
 
-    df = pd.read_excel(BytesIO(file_bytes), engine=engine, header=header_row)
-    _excel_cache_set(file_bytes, df)
-    return df.copy(deep=True)
+    return _frame_from_header_row(raw, header_row)
+
+
+_MONTH_SEPARATORS = frozenset("-_/")
+
+
+def _skip_separator(col_str: str, pos: int) -> int:
+    # Equivalente a \s*[-_/]?\s*: espacios, un separador opcional y más espacios.
+    end = len(col_str)
+    while pos < end and col_str[pos].isspace():
+        pos += 1
+    if pos < end and col_str[pos] in _MONTH_SEPARATORS:
+        pos += 1
+    while pos < end and col_str[pos].isspace():
+        pos += 1
+    return pos
+
+
+def _is_full_year(token: str) -> bool:
+    return len(token) == 4 and token.startswith("20") and token[2:].isdecimal()
+
+
+@lru_cache(maxsize=4096)
+def _parse_month_header(col_str: str) -> Optional[Tuple[int, int]]:
+    # Escáner de una pasada, sin regex, para las formas admitidas (col_str ya en minúsculas y sin bordes):
+    #   "ene 2024", "ene-2024", "ene_24", "ene2024"  -> mes, separador opcional, año de 4 o 2 dígitos
+    #   "2024 ene", "2024-ene"                       -> año de 4 dígitos, separador opcional, mes
+    #   "ene 2024 real"                              -> mes, espacios, año y tokens extra tras un espacio
+    month_num = MONTH_MAP.get(col_str[:3])
+    if month_num:
+        year = col_str[_skip_separator(col_str, 3):]
+        if _is_full_year(year):
+            return month_num, int(year)
+        if len(year) == 2 and year.isdecimal():
+            return month_num, 2000 + int(year)
+        if len(col_str) > 3 and col_str[3].isspace():
+            pos = 4
+            while pos < len(col_str) and col_str[pos].isspace():
+                pos += 1
+            year = col_str[pos:pos + 4]
+            if _is_full_year(year) and len(col_str) > pos + 4 and col_str[pos + 4].isspace():
+                return month_num, int(year)
+        return None
+
+    if _is_full_year(col_str[:4]):
+        month_num = MONTH_MAP.get(col_str[_skip_separator(col_str, 4):])
+        if month_num:
+            return month_num, int(col_str[:4])
+    return None
 
 
 def _parse_month_column(col: str) -> Optional[MonthColumn]:
-    col_str = str(col).strip().lower()
+    return _month_column_for(str(col))
+
+
+@lru_cache(maxsize=4096)
+def _month_column_for(col: str) -> Optional[MonthColumn]:
+    # Memoizado por cabecera cruda: strip/lower y la construcción de MonthColumn se hacen una vez.
+    col_str = col.strip().lower()
     if not col_str:
         return None
 
-    for rx in MONTH_REGEXES:
-        m = rx.match(col_str)
-        if not m:
-            continue
-        mon = m.group("mon").lower()
-        year_raw = m.group("year")
-        year = int(year_raw)
-        if year < 100:
-            year += 2000
-        month_num = MONTH_MAP.get(mon)
-        if not month_num:
-            return None
-        return MonthColumn(col=str(col), month=month_num, year=year, date=datetime(year, month_num, 1))
-
-    # Try split format: "ene 2024" with extra tokens
-    parts = re.split(r"\s+", col_str)
-    if len(parts) >= 2:
-        mon = parts[0]
-        year_part = parts[1]
-        if mon in MONTH_MAP and re.match(r"^20\d{2}$", year_part):
-            year = int(year_part)
-            month_num = MONTH_MAP[mon]
-            return MonthColumn(col=str(col), month=month_num, year=year, date=datetime(year, month_num, 1))
-
-    return None
+    parsed = _parse_month_header(col_str)
+    if not parsed:
+        return None
+    month_num, year = parsed
+    return MonthColumn(col=col, month=month_num, year=year, date=datetime(year, month_num, 1))
 
 
 def _find_month_columns(df: pd.DataFrame) -> List[MonthColumn]:
@@ -180,24 +339,18 @@ def _find_month_columns(df: pd.DataFrame) -> List[MonthColumn]:
         mc = _parse_month_column(col)
         if mc:
             cols.append(mc)
-    return sorted(cols, key=lambda x: x.date)
+    return sorted(cols, key=lambda x: x.ordinal)
 
 
 def _find_latest_pair(month_cols: List[MonthColumn]) -> YoYPair:
-    pairs: List[YoYPair] = []
-    for mc in month_cols:
-        prev = next((m for m in month_cols if m.month == mc.month and m.year == mc.year - 1), None)
+    # Búsqueda del año anterior por clave (primera columna de cada mes) desde el final: basta el último par.
+    prev_of = _prev_year_map(month_cols)
+    for mc in reversed(month_cols):
+        prev = prev_of[mc.col]
         if prev:
-            pairs.append(YoYPair(current=mc, previous=prev, label=f"{mc.col} vs {prev.col}"))
-
-    if not pairs:
-        raise AnalysisError("No se encontraron pares YoY. Se necesitan meses del mismo mes en años distintos.")
-
-    return pairs[-1]
-
-def _month_key(mc: MonthColumn) -> str:
-    return f"{mc.year:04d}-{mc.month:02d}"
+            return YoYPair(current=mc, previous=prev, label=f"{mc.col} vs {prev.col}")
 
+    raise AnalysisError("No se encontraron pares YoY. Se necesitan meses del mismo mes en años distintos.")
 
 def _label_for_month(year: int, month: int) -> str:
     return f"{MONTH_NAME.get(month, str(month))} {year}"
@@ -205,19 +358,37 @@ def _label_for_month(year: int, month: int) -> str:
 
 def _find_month_by_key(month_cols: List[MonthColumn], key: str) -> Optional[MonthColumn]:
     for mc in month_cols:
-        if _month_key(mc) == key:
+        if mc.key == key:
             return mc
     return None
 
 
+def _prev_year_map(month_cols: List[MonthColumn]) -> Dict[str, Optional[MonthColumn]]:
+    by_key: Dict[str, MonthColumn] = {}
+    for mc in month_cols:
+        by_key.setdefault(mc.key, mc)
+    return {mc.col: by_key.get(mc.prev_key) for mc in month_cols}
+
+
+def _yoy_index_pairs(
+    month_cols: List[MonthColumn],
+    prev_of: Dict[str, Optional[MonthColumn]],
+    col_pos: Dict[str, int],
+) -> Tuple[List[MonthColumn], List[int], List[int]]:
+    # Meses con su equivalente del año anterior y las posiciones (actual, previo) en la matriz de ventas.
+    with_prev = [mc for mc in month_cols if prev_of[mc.col]]
+    curr_idx = [col_pos[mc.col] for mc in with_prev]
+    prev_idx = [col_pos[prev_of[mc.col].col] for mc in with_prev]
+    return with_prev, curr_idx, prev_idx
+
+
 def _build_available_months(month_cols: List[MonthColumn]) -> List[Dict]:
-    keys = {_month_key(mc): mc for mc in month_cols}
+    keys = {mc.key: mc for mc in month_cols}
     available = []
     for mc in month_cols:
-        prev_key = f"{mc.year - 1:04d}-{mc.month:02d}"
-        has_prev = prev_key in keys
+        has_prev = mc.prev_key in keys
         available.append({
-            "key": _month_key(mc),
+            "key": mc.key,
             "label": _label_for_month(mc.year, mc.month),
             "year": mc.year,
             "month": mc.month,
@@ -230,11 +401,12 @@ def _period_columns(
     month_cols: List[MonthColumn],
     mode: str,
     month_key: Optional[str],
+    prev_of: Optional[Dict[str, Optional[MonthColumn]]] = None,
 ) -> Tuple[List[MonthColumn], List[MonthColumn], str, str, str, str]:
     if not month_cols:
         raise AnalysisError("No se detectaron columnas de meses.")
 
-    month_cols = sorted(month_cols, key=lambda x: x.date)
+    month_cols = sorted(month_cols, key=lambda x: x.ordinal)
     if month_key:
         selected = _find_month_by_key(month_cols, month_key)
     else:
@@ -243,8 +415,11 @@ def _period_columns(
     if not selected:
         raise AnalysisError("Mes seleccionado no disponible.")
 
+    if prev_of is None:
+        prev_of = _prev_year_map(month_cols)
+
     if mode == "month":
-        prev = _find_month_by_key(month_cols, f"{selected.year - 1:04d}-{selected.month:02d}")
+        prev = prev_of[selected.col]
         if not prev:
             raise AnalysisError("No existe el mismo mes del año anterior para el mes seleccionado.")
         label = f"{selected.col} vs {prev.col}"
@@ -270,7 +445,7 @@ def _period_columns(
         curr_window = month_cols[idx - window + 1 : idx + 1]
         prev_window = []
         for m in curr_window:
-            prev = _find_month_by_key(month_cols, f"{m.year - 1:04d}-{m.month:02d}")
+            prev = prev_of[m.col]
             if not prev:
                 raise AnalysisError("No hay suficientes meses del año anterior para el rolling seleccionado.")
             prev_window.append(prev)
@@ -283,39 +458,230 @@ def _period_columns(
     raise AnalysisError("Modo no soportado. Usa month, ytd, rolling3 o rolling6.")
 
 
+# Por debajo de este tamaño el arranque de numexpr cuesta más que las pasadas extra de NumPy.
+_NUMEXPR_MIN_ROWS = 20_000
+
+
+def _yoy_pct(curr: np.ndarray, prev: np.ndarray) -> np.ndarray:
+    # Var % por fila: 0 si ambos periodos son 0 y NaN si solo el anterior es 0.
+    if _HAS_NUMEXPR and len(curr) >= _NUMEXPR_MIN_ROWS:
+        return numexpr.evaluate(
+            "where(prev != 0, (curr - prev) / prev * 100, where(curr == 0, 0.0, nan))",
+            local_dict={"curr": curr, "prev": prev, "nan": np.nan},
+        )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(prev != 0, (curr - prev) / prev * 100, np.where(curr == 0, 0.0, np.nan))
+
+
+def _period_weights(col_pos: Dict[str, int], period_cols: List[MonthColumn]) -> np.ndarray:
+    weights = np.zeros(len(col_pos))
+    weights[[col_pos[mc.col] for mc in period_cols]] = 1.0
+    return weights
+
+
 def _sanitize_df(df: pd.DataFrame) -> pd.DataFrame:
     if "Cliente" not in df.columns:
         raise AnalysisError("No se encontró la columna 'Cliente'. Revisa el archivo.")
 
-    df = df[df["Cliente"].notna()].copy()
-    df = df[~df["Cliente"].astype(str).str.strip().isin(["Ventas", "Total"])].copy()
-    return df
+    # Una sola máscara; con Copy-on-Write la selección ya es un frame nuevo y no hace falta .copy().
+    cliente = df["Cliente"].astype(_STRING_DTYPE)
+    keep = cliente.notna() & ~cliente.str.strip().isin(("Ventas", "Total"))
+    return df[keep].assign(Cliente=cliente[keep])
+
+def _detect_country_col(df: pd.DataFrame) -> Optional[str]:
+    # Country/Area heuristics (si existen)
+    for col in COUNTRY_COLUMNS:
+        if col in df.columns:
+            return col
+    return None
 
-def _build_hotel_series(df: pd.DataFrame, month_cols: List[MonthColumn], top_names: List[str]) -> Dict[str, List[Dict]]:
-    series = {}
-    if not top_names:
-        return series
 
-    for name in top_names:
-        hotel_df = df[df["Cliente"] == name]
-        if hotel_df.empty:
-            continue
-        row = hotel_df.iloc[0]
-        items = []
-        for mc in month_cols:
-            prev = _find_month_by_key(month_cols, f"{mc.year - 1:04d}-{mc.month:02d}")
-            if not prev:
+def _build_search_haystack(df: pd.DataFrame, country_col: Optional[str]) -> pd.Series:
+    # Texto de búsqueda por fila (hotel, código, ubicación, país), calculado una vez por archivo.
+    extra = [
+        df[col].astype(_STRING_DTYPE).fillna("")
+        for col in ("Hotel - Code", "Ubicación", country_col)
+        if col and col in df.columns
+    ]
+    hay = df["Cliente"]
+    if extra:
+        hay = hay.str.cat(extra, sep=" ")
+    return hay.str.lower()
+
+
+def _parse_workbook(file_bytes: bytes, filename: str) -> ParsedWorkbook:
+    return _parse_frame(_read_excel(file_bytes, filename))
+
+
+def _parse_frame(raw: pd.DataFrame) -> ParsedWorkbook:
+    df = _sanitize_df(raw)
+    month_cols = _find_month_columns(df)
+    month_col_names = [m.col for m in month_cols]
+    # Conversión numérica única de todas las columnas de meses; el resto del análisis lee floats directamente.
+    # Solo pasan por to_numeric las columnas con texto mezclado; las ya numéricas solo se rellenan.
+    if month_col_names:
+        dtypes = df.dtypes
+        to_convert = [col for col in month_col_names if not pd.api.types.is_numeric_dtype(dtypes[col])]
+        if to_convert:
+            df[to_convert] = df[to_convert].apply(pd.to_numeric, errors="coerce")
+        df[month_col_names] = df[month_col_names].fillna(0.0).astype(np.float64)
+    # Cluster derivado por prefijo de Cliente hasta ':'
+    df["Cluster"] = df["Cliente"].str.replace(_CLUSTER_SUFFIX, "", regex=True).str.strip()
+
+    country_col = _detect_country_col(df)
+    search_hay = _build_search_haystack(df, country_col)
+    # Columnas de agrupación con pocos valores distintos: categóricas para agrupar por códigos enteros.
+    for col in ("Ubicación", "Cluster", country_col):
+        if col and col in df.columns:
+            df[col] = df[col].astype("category")
+    month_matrix = df[month_col_names].to_numpy(dtype=np.float64)
+    month_matrix.setflags(write=False)
+    return ParsedWorkbook(
+        df=df,
+        month_cols=month_cols,
+        available_months=_build_available_months(month_cols),
+        country_col=country_col,
+        search_hay=search_hay,
+        month_matrix=month_matrix,
+        col_pos={mc.col: idx for idx, mc in enumerate(month_cols)},
+        prev_of=_prev_year_map(month_cols),
+    )
+
+
+def _cached_parse(key: bytes, parse: Callable[[], ParsedWorkbook]) -> ParsedWorkbook:
+    # Parsea una sola vez por contenido; los cambios de modo/filtros reutilizan el resultado.
+    # Peticiones concurrentes sobre el mismo contenido esperan al primer parseo en lugar de repetirlo.
+    parsed = _excel_cache_get(key)
+    if parsed is None:
+        with _parse_lock(key):
+            parsed = _excel_cache_get(key)
+            if parsed is None:
+                parsed = parse()
+                _excel_cache_set(key, parsed)
+    return parsed
+
+
+def _cached_workbook(file_bytes: bytes, filename: str, key: Optional[bytes] = None) -> ParsedWorkbook:
+    return _cached_parse(key or _file_key(file_bytes), lambda: _parse_workbook(file_bytes, filename))
+
+
+def _frame_key(df: pd.DataFrame) -> bytes:
+    digest = hashlib.blake2b(repr(list(df.columns)).encode(), digest_size=16)
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.digest()
+
+
+def _cached_frame(df: pd.DataFrame) -> ParsedWorkbook:
+    return _cached_parse(_frame_key(df), lambda: _parse_frame(_frame_from_records(df)))
+
+
+def _load_workbook(file_bytes: bytes, filename: str, key: Optional[bytes] = None) -> ParsedWorkbook:
+    parsed = _cached_workbook(file_bytes, filename, key)
+    # analyze_yoy solo añade columnas: basta una copia superficial del DataFrame cacheado.
+    return replace(parsed, df=parsed.df.copy(deep=False))
+
+
+def _build_hotel_series(
+    df: pd.DataFrame,
+    sales: np.ndarray,
+    month_cols: List[MonthColumn],
+    col_pos: Dict[str, int],
+    top_names: Dict[str, List[str]],
+    prev_of: Dict[str, Optional[MonthColumn]],
+) -> Dict[str, Dict[str, List[Dict]]]:
+    # Todos los grupos (alertas, crecimientos) se resuelven juntos: una búsqueda de filas y una
+    # lectura de la matriz de ventas compartida para todos los hoteles.
+    result: Dict[str, Dict[str, List[Dict]]] = {group: {} for group in top_names}
+    all_names = [name for names in top_names.values() for name in names]
+    if not all_names:
+        return result
+
+    # Primera fila de cada cliente, indexada directamente sobre la matriz de ventas compartida.
+    clientes = pd.Index(df["Cliente"])
+    first = ~clientes.duplicated()
+    found = pd.Index(clientes[first]).get_indexer(all_names)
+    if not (found >= 0).any():
+        return result
+
+    with_prev, curr_idx, prev_idx = _yoy_index_pairs(month_cols, prev_of, col_pos)
+    labels = [_label_for_month(mc.year, mc.month) for mc in with_prev]
+
+    values = sales[np.flatnonzero(first)[np.where(found >= 0, found, 0)]]
+    curr = values[:, curr_idx]
+    prev = values[:, prev_idx]
+    has_prev = prev > 0
+    var_pct = ((curr - prev) / np.where(has_prev, prev, 1.0) * 100).tolist()
+
+    rows = iter(zip(found.tolist(), curr.tolist(), var_pct, has_prev.tolist()))
+    for group, names in top_names.items():
+        for name in names:
+            pos, curr_row, var_row, valid_row = next(rows)
+            if pos < 0:
                 continue
-            curr_val = float(pd.to_numeric(row.get(mc.col, 0), errors="coerce") or 0)
-            prev_val = float(pd.to_numeric(row.get(prev.col, 0), errors="coerce") or 0)
-            var_pct = ((curr_val - prev_val) / prev_val * 100) if prev_val > 0 else None
-            items.append({
-                "label": _label_for_month(mc.year, mc.month),
-                "curr": curr_val,
-                "varPct": var_pct,
-            })
-        series[name] = items
-    return series
+            result[group][name] = [
+                {"label": label, "curr": curr_val, "varPct": var if valid else None}
+                for label, curr_val, var, valid in zip(labels, curr_row, var_row, valid_row)
+            ]
+    return result
+
+
+def _nullable_list(values: pd.Series) -> List:
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+_SUMMARY_COLUMNS = ["Previous_Sum", "Current_Sum", "Var_Absoluta"]
+
+
+def _group_summary(keys: pd.Series, amounts: np.ndarray) -> pd.DataFrame:
+    # Agregación por códigos de la categórica con bincount: las tres agrupaciones comparten la
+    # misma matriz de importes y no se vuelve a hashear el frame en cada una.
+    if not isinstance(keys.dtype, pd.CategoricalDtype):
+        keys = keys.astype("category")
+    categories = keys.cat.categories
+    codes = keys.cat.codes.to_numpy()
+    valid = codes >= 0
+    codes = codes[valid]
+    amounts = amounts[valid]
+    sums = np.column_stack([
+        np.bincount(codes, weights=amounts[:, idx], minlength=len(categories))
+        for idx in range(amounts.shape[1])
+    ])
+    observed = np.bincount(codes, minlength=len(categories)) > 0
+    summary = pd.DataFrame(sums[observed], index=categories[observed], columns=_SUMMARY_COLUMNS)
+    prev = summary["Previous_Sum"].to_numpy()
+    curr = summary["Current_Sum"].to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        summary["Var_%"] = np.where(prev != 0, (curr / prev - 1) * 100, np.nan)
+    return summary.sort_values("Var_Absoluta", ascending=False)
+
+
+def _clean_amounts(values: np.ndarray) -> Tuple[np.ndarray, List[Optional[float]]]:
+    # Prev/Curr/VarAbs no finitos pasan a 0 y Var_% no finito a None, en bloque y no celda a celda.
+    finite = np.isfinite(values)
+    totals = np.where(finite[:, :3], values[:, :3], 0.0)
+    var_pct = values[:, 3].astype(object)
+    var_pct[~finite[:, 3]] = None
+    return totals, var_pct.tolist()
+
+
+def _summary_rows(summary: pd.DataFrame, label_key: str) -> List[Dict]:
+    totals, var_pct = _clean_amounts(summary[["Previous_Sum", "Current_Sum", "Var_Absoluta", "Var_%"]].to_numpy(dtype=np.float64))
+    return [
+        {
+            label_key: label,
+            "Prev": prev,
+            "Curr": curr,
+            "VarAbs": var_abs,
+            "VarPct": pct,
+        }
+        for label, prev, curr, var_abs, pct in zip(
+            summary.index.tolist(),
+            totals[:, 0].tolist(),
+            totals[:, 1].tolist(),
+            totals[:, 2].tolist(),
+            var_pct,
+        )
+    ]
 
 
 def analyze_yoy(
@@ -333,77 +699,100 @@ def analyze_yoy(
     persist_threshold: Optional[float] = None,
     recovery_threshold: Optional[float] = None,
     churn_months: int = 9,
+    include_churn: bool = True,
+    include_cohorts: bool = True,
+    file_key: Optional[bytes] = None,
 ) -> Dict:
-    df = _read_excel(file_bytes, filename)
-    df = _sanitize_df(df)
+    # file_key: hash del fichero ya calculado por el llamador (se evita volver a hashear los bytes).
+    return _analyze_parsed(
+        _load_workbook(file_bytes, filename, file_key),
+        alert_threshold=alert_threshold,
+        mode=mode,
+        month_key=month_key,
+        search=search,
+        location=location,
+        impact_min=impact_min,
+        impact_max=impact_max,
+        var_min=var_min,
+        var_max=var_max,
+        persist_threshold=persist_threshold,
+        recovery_threshold=recovery_threshold,
+        churn_months=churn_months,
+        include_churn=include_churn,
+        include_cohorts=include_cohorts,
+    )
 
-    month_cols = _find_month_columns(df)
-    available_months = _build_available_months(month_cols)
-    curr_cols, prev_cols, label, period_label, current_label, previous_label = _period_columns(month_cols, mode, month_key)
+
+def analyze_yoy_df(df: pd.DataFrame, **params) -> Dict:
+    # Datos que ya llegan como DataFrame con cabecera (NetSuite): mismo análisis sin pasar por Excel.
+    # Acepta los mismos parámetros que analyze_yoy.
+    parsed = _cached_frame(df)
+    return _analyze_parsed(replace(parsed, df=parsed.df.copy(deep=False)), **params)
+
+
+def _analyze_parsed(
+    parsed: ParsedWorkbook,
+    alert_threshold: float = -30.0,
+    mode: str = "month",
+    month_key: Optional[str] = None,
+    search: Optional[str] = None,
+    location: Optional[str] = None,
+    impact_min: Optional[float] = None,
+    impact_max: Optional[float] = None,
+    var_min: Optional[float] = None,
+    var_max: Optional[float] = None,
+    persist_threshold: Optional[float] = None,
+    recovery_threshold: Optional[float] = None,
+    churn_months: int = 9,
+    include_churn: bool = True,
+    include_cohorts: bool = True,
+) -> Dict:
+    df = parsed.df
+    month_cols = parsed.month_cols
+    available_months = parsed.available_months
+    country_col = parsed.country_col
+    search_hay = parsed.search_hay
+    prev_of = parsed.prev_of
+    curr_cols, prev_cols, label, period_label, current_label, previous_label = _period_columns(month_cols, mode, month_key, prev_of)
     latest_col = curr_cols[-1].col
     prev_col = prev_cols[-1].col
 
-    for mc in curr_cols + prev_cols:
-        df[mc.col] = pd.to_numeric(df[mc.col], errors="coerce").fillna(0)
-
-    df["Current_Sum"] = df[[m.col for m in curr_cols]].sum(axis=1)
-    df["Previous_Sum"] = df[[m.col for m in prev_cols]].sum(axis=1)
+    # Sumas del periodo como producto matriz-vector sobre la matriz de meses (una sola pasada).
+    month_matrix = parsed.month_matrix
+    col_pos = parsed.col_pos
+    yoy_months, yoy_curr_idx, yoy_prev_idx = _yoy_index_pairs(month_cols, prev_of, col_pos)
+    df["Current_Sum"] = month_matrix @ _period_weights(col_pos, curr_cols)
+    df["Previous_Sum"] = month_matrix @ _period_weights(col_pos, prev_cols)
 
     df["Var_Absoluta"] = df["Current_Sum"] - df["Previous_Sum"]
-    prev_nonzero = df["Previous_Sum"] != 0
-    both_zero = (df["Previous_Sum"] == 0) & (df["Current_Sum"] == 0)
-    df["Var_%"] = np.where(
-        prev_nonzero,
-        (df["Current_Sum"] - df["Previous_Sum"]) / df["Previous_Sum"] * 100,
-        np.where(both_zero, 0.0, np.nan),
-    )
+    df["Var_%"] = _yoy_pct(df["Current_Sum"].to_numpy(), df["Previous_Sum"].to_numpy())
     df["Impacto"] = df["Var_Absoluta"].abs()
 
-    # Cluster derivado por prefijo de Cliente hasta ':'
-    df["Cluster"] = df["Cliente"].astype(str).str.split(":").str[0].str.strip()
-
-    # Country/Area heuristics (si existen)
-    country_col = None
-    for col in ["País", "Pais", "Country", "Hotel Country", "Hotel Country "]:
-        if col in df.columns:
-            country_col = col
-            break
-
-    def _apply_filters(dfx: pd.DataFrame) -> pd.DataFrame:
-        filtered = dfx.copy()
+    def _filter_mask() -> np.ndarray:
+        mask = np.ones(len(df), dtype=bool)
         if search:
-            needle = str(search).strip().lower()
-            if needle:
-                hay = (
-                    filtered["Cliente"].astype(str).str.lower()
-                    + " "
-                    + filtered.get("Hotel - Code", "").astype(str).str.lower()
-                )
-                if "Ubicación" in filtered.columns:
-                    hay = hay + " " + filtered["Ubicación"].astype(str).str.lower()
-                if country_col and country_col in filtered.columns:
-                    hay = hay + " " + filtered[country_col].astype(str).str.lower()
-                filtered = filtered[hay.str.contains(needle, na=False)]
-        if location and location != "all" and "Ubicación" in filtered.columns:
-            filtered = filtered[filtered["Ubicación"] == location]
+            # Cada término separado por espacios debe aparecer (AND); búsqueda literal, sin regex.
+            for term in str(search).lower().split():
+                mask &= search_hay.str.contains(term, regex=False, na=False).to_numpy(dtype=bool)
+        if location and location != "all" and "Ubicación" in df.columns:
+            mask &= (df["Ubicación"] == location).to_numpy(dtype=bool)
+        impact = df["Impacto"].to_numpy()
+        var_pct = df["Var_%"].to_numpy()
+        # Las comparaciones con NaN son False: los Var_% nulos quedan fuera de los filtros de variación.
         if impact_min is not None:
-            filtered = filtered[filtered["Impacto"] >= impact_min]
+            mask &= impact >= impact_min
         if impact_max is not None:
-            filtered = filtered[filtered["Impacto"] <= impact_max]
+            mask &= impact <= impact_max
         if var_min is not None:
-            filtered = filtered[(filtered["Var_%"].notna()) & (filtered["Var_%"] >= var_min)]
+            mask &= var_pct >= var_min
         if var_max is not None:
-            filtered = filtered[(filtered["Var_%"].notna()) & (filtered["Var_%"] <= var_max)]
-        return filtered
-
-    df_filtered = _apply_filters(df)
+            mask &= var_pct <= var_max
+        return mask
 
-    def _safe_float(value):
-        if value is None:
-            return None
-        if isinstance(value, float) and (np.isnan(value) or np.isinf(value)):
-            return None
-        return float(value)
+    # Filas filtradas y su submatriz de ventas: churn, series y cohortes no vuelven a leer el DataFrame.
+    row_mask = _filter_mask()
+    df_filtered = df[row_mask]
+    sales = month_matrix[row_mask]
 
     total_current = float(df_filtered["Current_Sum"].sum())
     total_previous = float(df_filtered["Previous_Sum"].sum())
@@ -418,72 +807,63 @@ def analyze_yoy(
     def _rows(dfx: pd.DataFrame) -> List[Dict]:
         if dfx.empty:
             return []
-        out = pd.DataFrame({
-            "Cliente": dfx["Cliente"],
-            "HotelCode": dfx["Hotel - Code"] if "Hotel - Code" in dfx.columns else None,
-            "Ubicacion": dfx["Ubicación"] if "Ubicación" in dfx.columns else None,
-            "Prev": dfx["Previous_Sum"],
-            "Curr": dfx["Current_Sum"],
-            "VarAbs": dfx["Var_Absoluta"],
-            "VarPct": dfx["Var_%"],
-        })
-        out = out.replace([np.inf, -np.inf], np.nan)
-        out["Prev"] = out["Prev"].fillna(0.0).astype(float)
-        out["Curr"] = out["Curr"].fillna(0.0).astype(float)
-        out["VarAbs"] = out["VarAbs"].fillna(0.0).astype(float)
-        out["VarPct"] = out["VarPct"].astype(float)
-        out = out.where(pd.notna(out), None)
-        return out.to_dict("records")
-
-    ubicacion_analysis = None
-    if "Ubicación" in df_filtered.columns:
-        ubicacion_analysis = df_filtered.groupby("Ubicación").agg({
-            "Previous_Sum": "sum",
-            "Current_Sum": "sum",
-            "Var_Absoluta": "sum",
-        })
-        ubicacion_analysis["Var_%"] = np.where(
-            ubicacion_analysis["Previous_Sum"] != 0,
-            (ubicacion_analysis["Current_Sum"] / ubicacion_analysis["Previous_Sum"] - 1) * 100,
-            np.nan,
-        )
-        ubicacion_analysis = ubicacion_analysis.sort_values("Var_Absoluta", ascending=False)
+        totals, var_pct = _clean_amounts(dfx[["Previous_Sum", "Current_Sum", "Var_Absoluta", "Var_%"]].to_numpy(dtype=np.float64))
+        empty = [None] * len(dfx)
+        return [
+            {
+                "Cliente": cliente,
+                "HotelCode": code,
+                "Ubicacion": ubicacion,
+                "Prev": prev,
+                "Curr": curr,
+                "VarAbs": var_abs,
+                "VarPct": pct,
+            }
+            for cliente, code, ubicacion, prev, curr, var_abs, pct in zip(
+                _nullable_list(dfx["Cliente"]),
+                _nullable_list(dfx["Hotel - Code"]) if "Hotel - Code" in dfx.columns else empty,
+                _nullable_list(dfx["Ubicación"]) if "Ubicación" in dfx.columns else empty,
+                totals[:, 0].tolist(),
+                totals[:, 1].tolist(),
+                totals[:, 2].tolist(),
+                var_pct,
+            )
+        ]
 
+    # Importes del periodo extraídos una vez para las agrupaciones por área, cluster y país.
+    group_amounts = df_filtered[_SUMMARY_COLUMNS].to_numpy(dtype=np.float64)
     locations = []
-    if ubicacion_analysis is not None:
-        for ubicacion, row in ubicacion_analysis.iterrows():
-            locations.append({
-                "Ubicacion": ubicacion,
-                "Prev": _safe_float(row["Previous_Sum"]) or 0.0,
-                "Curr": _safe_float(row["Current_Sum"]) or 0.0,
-                "VarAbs": _safe_float(row["Var_Absoluta"]) or 0.0,
-                "VarPct": _safe_float(row["Var_%"]),
-            })
+    if "Ubicación" in df_filtered.columns:
+        locations = _summary_rows(_group_summary(df_filtered["Ubicación"], group_amounts), "Ubicacion")
+
+    active = sales > 0
+    has_any = active.any(axis=1)
 
     # Serie temporal para gráficos (totales mensuales con YoY disponible)
-    series = []
-    for mc in month_cols:
-        prev = _find_month_by_key(month_cols, f"{mc.year - 1:04d}-{mc.month:02d}")
-        if not prev:
-            continue
-        curr_total = float(df_filtered[mc.col].sum())
-        prev_total = float(df_filtered[prev.col].sum())
-        var_pct = ((curr_total - prev_total) / prev_total * 100) if prev_total > 0 else None
-        series.append({
-            "key": _month_key(mc),
+    month_totals = sales.sum(axis=0)
+    curr_totals = month_totals[yoy_curr_idx]
+    prev_totals = month_totals[yoy_prev_idx]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        series_pct = (curr_totals - prev_totals) / prev_totals * 100
+    series = [
+        {
+            "key": mc.key,
             "label": _label_for_month(mc.year, mc.month),
             "curr": curr_total,
             "prev": prev_total,
-            "varPct": var_pct,
-        })
+            "varPct": var_pct if prev_total > 0 else None,
+        }
+        for mc, curr_total, prev_total, var_pct in zip(
+            yoy_months, curr_totals.tolist(), prev_totals.tolist(), series_pct.tolist()
+        )
+    ]
 
     # Sparklines for top 10 in alerts and growth
-    top_alerts = [row["Cliente"] for row in alerts.head(10).to_dict("records")]
-    top_growth = [row["Cliente"] for row in growth.head(10).to_dict("records")]
-    hotel_series = {
-        "alerts": _build_hotel_series(df_filtered, month_cols, top_alerts),
-        "growth": _build_hotel_series(df_filtered, month_cols, top_growth),
-    }
+    top_alerts = alerts["Cliente"].head(10).tolist()
+    top_growth = growth["Cliente"].head(10).tolist()
+    hotel_series = _build_hotel_series(
+        df_filtered, sales, month_cols, col_pos, {"alerts": top_alerts, "growth": top_growth}, prev_of
+    )
 
     persist_threshold = alert_threshold if persist_threshold is None else persist_threshold
     recovery_threshold = 0.0 if recovery_threshold is None else recovery_threshold
@@ -493,137 +873,103 @@ def analyze_yoy(
     if len(month_cols) >= 2:
         latest = month_cols[-1]
         prev_month = month_cols[-2]
-        latest_prev = _find_month_by_key(month_cols, f"{latest.year - 1:04d}-{latest.month:02d}")
-        prev_prev = _find_month_by_key(month_cols, f"{prev_month.year - 1:04d}-{prev_month.month:02d}")
+        latest_prev = prev_of[latest.col]
+        prev_prev = prev_of[prev_month.col]
         if latest_prev and prev_prev:
-            curr_last = pd.to_numeric(df_filtered[latest.col], errors="coerce").fillna(0.0)
-            prev_last = pd.to_numeric(df_filtered[latest_prev.col], errors="coerce").fillna(0.0)
-            curr_prev = pd.to_numeric(df_filtered[prev_month.col], errors="coerce").fillna(0.0)
-            prev_prev_vals = pd.to_numeric(df_filtered[prev_prev.col], errors="coerce").fillna(0.0)
-
-            var_last = np.where(prev_last != 0, (curr_last - prev_last) / prev_last * 100, np.nan)
-            var_prev = np.where(prev_prev_vals != 0, (curr_prev - prev_prev_vals) / prev_prev_vals * 100, np.nan)
-
-            alerts_df = pd.DataFrame({
-                "Cliente": df_filtered["Cliente"],
-                "Ubicacion": df_filtered["Ubicación"] if "Ubicación" in df_filtered.columns else None,
-                "VarPctLast": var_last,
-                "VarPctPrev": var_prev,
-            }).replace([np.inf, -np.inf], np.nan)
-
-            valid = alerts_df["VarPctLast"].notna() & alerts_df["VarPctPrev"].notna()
-            persistent_mask = valid & (alerts_df["VarPctLast"] <= persist_threshold) & (alerts_df["VarPctPrev"] <= persist_threshold)
-            recovery_mask = valid & (alerts_df["VarPctPrev"] <= persist_threshold) & (alerts_df["VarPctLast"] >= recovery_threshold)
+            # Los dos YoY (último mes y anterior) en una sola pasada sobre dos columnas de la matriz.
+            curr = sales[:, [col_pos[latest.col], col_pos[prev_month.col]]]
+            prev = sales[:, [col_pos[latest_prev.col], col_pos[prev_prev.col]]]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                var_pair = np.where(prev != 0, (curr - prev) / prev * 100, np.nan)
+            var_last = var_pair[:, 0]
+            var_prev = var_pair[:, 1]
+
+            # Las comparaciones con NaN son False, así que las filas sin YoY quedan fuera de ambas máscaras.
+            persistent_mask = (var_last <= persist_threshold) & (var_prev <= persist_threshold)
+            recovery_mask = (var_prev <= persist_threshold) & (var_last >= recovery_threshold)
+
+            def _intelligent_rows(mask: np.ndarray) -> List[Dict]:
+                idx = np.flatnonzero(mask)
+                if not len(idx):
+                    return []
+                # Solo se leen las columnas necesarias de las filas seleccionadas, sin copiar el frame.
+                ubicaciones = (
+                    _nullable_list(df_filtered["Ubicación"].iloc[idx])
+                    if "Ubicación" in df_filtered.columns
+                    else [None] * len(idx)
+                )
+                return [
+                    {"Cliente": cliente, "Ubicacion": ubicacion, "VarPctLast": last, "VarPctPrev": prev}
+                    for cliente, ubicacion, last, prev in zip(
+                        _nullable_list(df_filtered["Cliente"].iloc[idx]),
+                        ubicaciones,
+                        var_last[idx].tolist(),
+                        var_prev[idx].tolist(),
+                    )
+                ]
 
-            intelligent_alerts["persistent"] = alerts_df[persistent_mask].to_dict("records")
-            intelligent_alerts["recovery"] = alerts_df[recovery_mask].to_dict("records")
+            intelligent_alerts["persistent"] = _intelligent_rows(persistent_mask)
+            intelligent_alerts["recovery"] = _intelligent_rows(recovery_mask)
 
     # Consolidación por cluster / país / área comercial
-    cluster_summary = df_filtered.groupby("Cluster").agg({
-        "Previous_Sum": "sum",
-        "Current_Sum": "sum",
-        "Var_Absoluta": "sum",
-    })
-    cluster_summary["Var_%"] = np.where(
-        cluster_summary["Previous_Sum"] != 0,
-        (cluster_summary["Current_Sum"] / cluster_summary["Previous_Sum"] - 1) * 100,
-        np.nan,
-    )
-    cluster_rows = [
-        {
-            "Cluster": idx,
-            "Prev": _safe_float(row["Previous_Sum"]) or 0.0,
-            "Curr": _safe_float(row["Current_Sum"]) or 0.0,
-            "VarAbs": _safe_float(row["Var_Absoluta"]) or 0.0,
-            "VarPct": _safe_float(row["Var_%"]),
-        }
-        for idx, row in cluster_summary.sort_values("Var_Absoluta", ascending=False).iterrows()
-    ]
+    cluster_rows = _summary_rows(_group_summary(df_filtered["Cluster"], group_amounts), "Cluster")
 
     country_rows = []
     if country_col:
-        country_summary = df_filtered.groupby(country_col).agg({
-            "Previous_Sum": "sum",
-            "Current_Sum": "sum",
-            "Var_Absoluta": "sum",
-        })
-        country_summary["Var_%"] = np.where(
-            country_summary["Previous_Sum"] != 0,
-            (country_summary["Current_Sum"] / country_summary["Previous_Sum"] - 1) * 100,
-            np.nan,
-        )
-        for idx, row in country_summary.sort_values("Var_Absoluta", ascending=False).iterrows():
-            country_rows.append({
-                "Country": idx,
-                "Prev": _safe_float(row["Previous_Sum"]) or 0.0,
-                "Curr": _safe_float(row["Current_Sum"]) or 0.0,
-                "VarAbs": _safe_float(row["Var_Absoluta"]) or 0.0,
-                "VarPct": _safe_float(row["Var_%"]),
-            })
+        country_rows = _summary_rows(_group_summary(df_filtered[country_col], group_amounts), "Country")
     # Churn: hoteles con 0 ventas por N meses
     churn_list = []
-    if month_cols:
-        month_col_names = [m.col for m in month_cols]
-        sales = df_filtered[month_col_names].apply(pd.to_numeric, errors="coerce").fillna(0.0).to_numpy()
-        active = sales > 0
-        rev_active = active[:, ::-1]
-        has_any = rev_active.any(axis=1)
-        idx_from_latest = np.where(has_any, np.argmax(rev_active, axis=1), len(month_cols))
-        months_inactive = idx_from_latest.astype(int)
-
-        churn_df = pd.DataFrame({
-            "Cliente": df_filtered["Cliente"],
-            "Ubicacion": df_filtered["Ubicación"] if "Ubicación" in df_filtered.columns else None,
-            "MonthsInactive": months_inactive,
-        })
-        churn_list = churn_df[churn_df["MonthsInactive"] >= churn_months].to_dict("records")
+    if include_churn and month_cols:
+        # Último mes activo (1..N, 0 si nunca vendió) en una pasada contigua hacia delante;
+        # meses sin ventas = N - último mes activo, así que los hoteles sin ventas quedan en N.
+        n_months = len(month_cols)
+        last_active = (active * np.arange(1, n_months + 1, dtype=np.min_scalar_type(n_months))).max(axis=1)
+        months_inactive = n_months - last_active.astype(np.int64)
+        churned = np.flatnonzero(months_inactive >= churn_months)
+
+        # Solo se materializan las filas que superan el umbral, y solo las columnas necesarias.
+        if len(churned):
+            ubicaciones = (
+                _nullable_list(df_filtered["Ubicación"].iloc[churned])
+                if "Ubicación" in df_filtered.columns
+                else [None] * len(churned)
+            )
+            churn_list = [
+                {"Cliente": cliente, "Ubicacion": ubicacion, "MonthsInactive": inactive}
+                for cliente, ubicacion, inactive in zip(
+                    _nullable_list(df_filtered["Cliente"].iloc[churned]), ubicaciones, months_inactive[churned].tolist()
+                )
+            ]
 
     # Cohortes: por primer mes con ventas
-    cohort_map = {}
-    if month_cols:
-        for _, row in df_filtered.iterrows():
-            first = None
-            for mc in month_cols:
-                val = pd.to_numeric(row.get(mc.col, 0), errors="coerce")
-                if val and val > 0:
-                    first = mc
-                    break
-            if not first:
-                continue
-            cohort_key = _month_key(first)
-            cohort_map.setdefault(cohort_key, [])
-            cohort_map[cohort_key].append(row)
-
     cohort_rows = []
-    cohort_cols = [_month_key(m) for m in month_cols]
-    for cohort_key, rows in cohort_map.items():
-        size = len(rows)
-        if size == 0:
-            continue
-        base_month = next(m for m in month_cols if _month_key(m) == cohort_key)
-        base_rev = sum(float(pd.to_numeric(r.get(base_month.col, 0), errors="coerce") or 0) for r in rows)
-        active = []
-        revenue = []
-        for mc in month_cols:
-            if mc.date < base_month.date:
-                active.append(None)
-                revenue.append(None)
-                continue
-            active_count = 0
-            rev = 0.0
-            for r in rows:
-                val = float(pd.to_numeric(r.get(mc.col, 0), errors="coerce") or 0)
-                if val > 0:
-                    active_count += 1
-                rev += val
-            active.append(round(active_count / size * 100, 1))
-            revenue.append(round((rev / base_rev * 100) if base_rev > 0 else 0.0, 1))
-        cohort_rows.append({
-            "cohort": cohort_key,
-            "size": size,
-            "active": active,
-            "revenue": revenue,
-        })
+    cohort_cols = [m.key for m in month_cols]
+    if include_cohorts and month_cols:
+        # Meses duplicados (mismo año-mes) comparten cohorte con la primera columna de esa clave.
+        canonical = np.array([cohort_cols.index(key) for key in cohort_cols])
+        cohort_idx = canonical[np.argmax(active, axis=1)]
+        bases, members = np.unique(cohort_idx[has_any], return_inverse=True)
+        if len(bases):
+            # Matriz de pertenencia cohorte x hotel: activos e ingresos por mes salen de dos productos.
+            membership = np.zeros((len(bases), len(members)))
+            membership[members, np.arange(len(members))] = 1.0
+            sizes = np.bincount(members)
+            active_pct = membership @ active[has_any] / sizes[:, None] * 100
+            month_rev = membership @ sales[has_any]
+            base_rev = month_rev[np.arange(len(bases)), bases]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                revenue_pct = np.where(base_rev[:, None] > 0, month_rev / base_rev[:, None] * 100, 0.0)
+            ordinals = np.array([m.ordinal for m in month_cols])
+            before_base = ordinals[None, :] < ordinals[bases][:, None]
+            for base, size, active_vals, revenue_vals, skip in zip(
+                bases.tolist(), sizes.tolist(), active_pct.tolist(), revenue_pct.tolist(), before_base.tolist()
+            ):
+                cohort_rows.append({
+                    "cohort": cohort_cols[base],
+                    "size": size,
+                    "active": [None if hidden else round(v, 1) for v, hidden in zip(active_vals, skip)],
+                    "revenue": [None if hidden else round(v, 1) for v, hidden in zip(revenue_vals, skip)],
+                })
 
     cohort_rows.sort(key=lambda r: r.get('cohort'))
 
@@ -635,7 +981,7 @@ def analyze_yoy(
             "periodLabel": period_label,
             "alertThreshold": alert_threshold,
             "mode": mode,
-            "monthKey": month_key or _month_key(curr_cols[-1]),
+            "monthKey": month_key or curr_cols[-1].key,
             "availableMonths": available_months,
             "filters": {
                 "search": search or "",
@@ -650,6 +996,8 @@ def analyze_yoy(
                 "recovery": recovery_threshold,
             },
             "churnMonths": churn_months,
+            "includeChurn": include_churn,
+            "includeCohorts": include_cohorts,
         },
         "summary": {
             "totalPrev": total_previous,
@@ -705,6 +1053,17 @@ def analyze_yoy(
 
 
 
+_QUIET_VAR_PCT = 1.0
+
+
+def _is_quiet_period(summary: Dict) -> bool:
+    return (
+        not summary.get("alertsCount")
+        and not summary.get("growthCount")
+        and abs(float(summary.get("totalVarPct") or 0.0)) < _QUIET_VAR_PCT
+    )
+
+
 def _build_ai_summary(
     summary: Dict,
     alerts: pd.DataFrame,
@@ -716,6 +1075,11 @@ def _build_ai_summary(
     heuristic = _build_ai_summary_heuristic(
         summary, alerts, growth, country_rows, location_rows, period_label
     )
+    if _is_quiet_period(summary):
+        # Sin alertas, sin crecimientos y variación ~0: no hay nada que el LLM pueda añadir.
+        # No es un fallo de Gemini, así que no se informa motivo de fallback en la UI.
+        heuristic["llmFallbackReason"] = None
+        return heuristic
     llm, llm_error = _build_ai_summary_gemini(
         summary, alerts, growth, country_rows, location_rows, period_label
     )
@@ -829,6 +1193,11 @@ def _default_actionable_filters(
     return items[:5]
 
 
+# Sesión compartida: las llamadas sucesivas a Gemini reutilizan la conexión TLS (keep-alive).
+_GEMINI_SESSION = requests.Session()
+_GEMINI_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+
 @retry(
     stop=stop_after_attempt(2),
     wait=wait_exponential(multiplier=0.4, min=0.4, max=1.2),
@@ -838,14 +1207,64 @@ def _default_actionable_filters(
 def _call_gemini_api(url: str, payload: dict, timeout: tuple) -> dict:
     """Call Gemini API with retry logic."""
     logger.info(f"Calling Gemini API (model in URL), timeout={timeout}")
-    response = requests.post(
+    response = _GEMINI_SESSION.post(
         url,
         headers={"Content-Type": "application/json"},
-        json=payload,
+        data=_json_dumps(payload).encode(),
         timeout=timeout,
     )
     response.raise_for_status()
-    return response.json()
+    return _json_loads(response.content)
+
+
+def _top_hotels_payload(frame: pd.DataFrame, n: int) -> List[Dict]:
+    # Columnas completas con zip en lugar de iterrows (sin construir una Series por fila).
+    head = frame.head(n)
+    return [
+        {"hotel": str(hotel), "impact": impact, "varPct": var_pct}
+        for hotel, impact, var_pct in zip(
+            head["Cliente"].tolist(),
+            head["Var_Absoluta"].astype(np.float64).tolist(),
+            head["Var_%"].astype(np.float64).tolist(),
+        )
+    ]
+
+
+_LLM_JSON_BLOCK = re.compile(r"\{.*\}", flags=re.S)
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _llm_json_candidates(raw: str):
+    yield raw
+    match = _LLM_JSON_BLOCK.search(raw)
+    if match:
+        yield match.group(0)
+        yield _CONTROL_CHARS.sub("", match.group(0))
+
+
+def _parse_llm_json(raw: str) -> Optional[Dict]:
+    # Texto directo, luego el bloque {...} que lo envuelve y por último sin caracteres de control.
+    for text in _llm_json_candidates(raw):
+        try:
+            parsed = _json_loads(text)
+        except ValueError:
+            continue
+        if isinstance(parsed, dict):
+            return parsed
+    return None
+
+
+def _take_texts(values, limit: int) -> List[str]:
+    # Una sola pasada de str().strip() por elemento, parando al llegar al límite de la sección.
+    out: List[str] = []
+    append = out.append
+    for item in values or []:
+        text = str(item).strip()
+        if text:
+            append(text)
+            if len(out) == limit:
+                break
+    return out
 
 
 def _build_ai_summary_gemini(
@@ -874,22 +1293,8 @@ def _build_ai_summary_gemini(
             "alertsCount": int(summary.get("alertsCount", 0) or 0),
             "growthCount": int(summary.get("growthCount", 0) or 0),
         },
-        "topAlerts": [
-            {
-                "hotel": str(row.get("Cliente", "N/D")),
-                "impact": float(row.get("Var_Absoluta", 0) or 0),
-                "varPct": float(row.get("Var_%", 0) or 0),
-            }
-            for _, row in alerts.head(3).iterrows()
-        ],
-        "topGrowth": [
-            {
-                "hotel": str(row.get("Cliente", "N/D")),
-                "impact": float(row.get("Var_Absoluta", 0) or 0),
-                "varPct": float(row.get("Var_%", 0) or 0),
-            }
-            for _, row in growth.head(3).iterrows()
-        ],
+        "topAlerts": _top_hotels_payload(alerts, 3),
+        "topGrowth": _top_hotels_payload(growth, 3),
         "topCountries": country_rows[:3],
         "topLocations": location_rows[:3],
     }
@@ -912,7 +1317,7 @@ def _build_ai_summary_gemini(
         "Escribe en espanol neutro, directo y accionable para CFO. "
         + criteria_prompt
         + " Datos de entrada: "
-        + json.dumps(payload, ensure_ascii=True)
+        + _json_dumps(payload)
     )
 
     url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
@@ -930,40 +1335,41 @@ def _build_ai_summary_gemini(
                 "responseMimeType": "application/json",
             },
         }
-        data = _call_gemini_api(url, request_payload, timeout=(2.0, timeout))
-
-        candidates = data.get("candidates") or []
-        if not candidates:
-            return None, "no_gemini_candidates"
-
-        parts = (((candidates[0] or {}).get("content") or {}).get("parts") or [])
-        raw = ""
-        for part in parts:
-            if isinstance(part, dict) and part.get("text"):
-                raw += str(part["text"])
-
-        raw = raw.strip()
-        if not raw:
-            logger.warning("Gemini returned empty response")
-            return None, "empty_gemini_response"
+        parsed = None
+        # Un único reintento cuando la respuesta llega vacía o sin JSON utilizable.
+        for _attempt in range(2):
+            data = _call_gemini_api(url, request_payload, timeout=(2.0, timeout))
+
+            candidates = data.get("candidates") or []
+            if not candidates:
+                return None, "no_gemini_candidates"
+
+            parts = (((candidates[0] or {}).get("content") or {}).get("parts") or [])
+            raw = ""
+            for part in parts:
+                if isinstance(part, dict) and part.get("text"):
+                    raw += str(part["text"])
+
+            raw = raw.strip()
+            if not raw:
+                logger.warning("Gemini returned empty response")
+                error = "empty_gemini_response"
+                continue
 
-        try:
-            parsed = json.loads(raw)
-        except Exception:
-            m = re.search(r"\{.*\}", raw, flags=re.S)
-            if not m:
-                return None, "invalid_gemini_json"
-            parsed = json.loads(m.group(0))
+            parsed = _parse_llm_json(raw)
+            if parsed is not None:
+                break
+            error = "invalid_gemini_json"
 
-        if not isinstance(parsed, dict):
-            return None, "invalid_gemini_json"
+        if parsed is None:
+            return None, error
 
         logger.info("Successfully parsed Gemini response")
-        conclusions = [str(x).strip() for x in (parsed.get("conclusions") or []) if str(x).strip()]
-        observations = [str(x).strip() for x in (parsed.get("observations") or []) if str(x).strip()]
-        risks = [str(x).strip() for x in (parsed.get("risks") or []) if str(x).strip()]
-        opportunities = [str(x).strip() for x in (parsed.get("opportunities") or []) if str(x).strip()]
-        actions = [str(x).strip() for x in (parsed.get("actions") or []) if str(x).strip()]
+        conclusions = _take_texts(parsed.get("conclusions"), 4)
+        observations = _take_texts(parsed.get("observations"), 4)
+        risks = _take_texts(parsed.get("risks"), 3)
+        opportunities = _take_texts(parsed.get("opportunities"), 3)
+        actions = _take_texts(parsed.get("actions"), 4)
 
         raw_filters = parsed.get("actionableFilters") or []
         actionable_filters: List[Dict] = []
@@ -990,11 +1396,11 @@ def _build_ai_summary_gemini(
 
         return {
             "source": "gemini",
-            "conclusions": conclusions[:4],
-            "observations": observations[:4],
-            "risks": risks[:3],
-            "opportunities": opportunities[:3],
-            "actions": actions[:4],
+            "conclusions": conclusions,
+            "observations": observations,
+            "risks": risks,
+            "opportunities": opportunities,
+            "actions": actions,
             "actionableFilters": actionable_filters[:6],
         }, None
     except requests.exceptions.Timeout:
@@ -1005,130 +1411,158 @@ def _build_ai_summary_gemini(
     except Exception as exc:
         return None, str(exc)
 
+@lru_cache(maxsize=256)
 def _safe_sheet_title(title: str) -> str:
     cleaned = "".join(ch for ch in title if ch not in "[]:*?/\\")
     return cleaned[:31] if len(cleaned) > 31 else cleaned
 
 
-def _write_summary_sheet(wb, result: Dict, title: str):
-    from openpyxl.styles import Font, PatternFill
-
+_FMT_EUR = "#,##0.00€"
+_FMT_PCT = "0.0%"
+
+
+class _ReportBook:
+    """Workbook xlsxwriter con los formatos compartidos creados una sola vez."""
+
+    def __init__(self, target):
+        import xlsxwriter
+
+        # constant_memory vuelca cada fila al terminarla en vez de mantener la hoja entera en memoria;
+        # exige escribir las filas en orden y fijar los formatos de columna antes de la primera fila.
+        self.wb = xlsxwriter.Workbook(target, {"constant_memory": True})
+        self.eur = self.wb.add_format({"num_format": _FMT_EUR})
+        self.pct = self.wb.add_format({"num_format": _FMT_PCT})
+        self.title = self.wb.add_format({"bold": True, "font_size": 16, "font_color": "#FFFFFF", "bg_color": "#C00000"})
+        self.section = self.wb.add_format({"bold": True, "font_size": 12})
+        self._headers: Dict[str, object] = {}
+        self._titles: set = set()
+        self._table_values: Dict[int, List[Tuple]] = {}
+
+    def header(self, color: str):
+        fmt = self._headers.get(color)
+        if fmt is None:
+            fmt = self.wb.add_format({"bold": True, "font_color": "#FFFFFF", "bg_color": f"#{color}"})
+            self._headers[color] = fmt
+        return fmt
+
+    def table_values(self, rows: List[Dict]) -> List[Tuple]:
+        # Las peticiones repetidas comparten el mismo resultado (y la misma lista de filas):
+        # las filas de la tabla se preparan una sola vez por libro.
+        values = self._table_values.get(id(rows))
+        if values is None:
+            values = []
+            for row in rows:
+                get = row.get
+                var_pct = get("VarPct")
+                values.append((
+                    get("Cliente"),
+                    get("HotelCode"),
+                    get("Ubicacion"),
+                    get("Prev"),
+                    get("Curr"),
+                    get("VarAbs"),
+                    None if var_pct is None else var_pct / 100.0,
+                ))
+            self._table_values[id(rows)] = values
+        return values
+
+    def add_sheet(self, title: str):
+        # xlsxwriter no renombra hojas duplicadas como openpyxl: se añade un sufijo numérico.
+        name = _safe_sheet_title(title)
+        candidate, counter = name, 1
+        while candidate.lower() in self._titles:
+            suffix = str(counter)
+            candidate = f"{name[:31 - len(suffix)]}{suffix}"
+            counter += 1
+        self._titles.add(candidate.lower())
+        return self.wb.add_worksheet(candidate)
+
+    def close(self) -> None:
+        self.wb.close()
+
+
+def _write_summary_sheet(book: _ReportBook, result: Dict, title: str):
     meta = result["meta"]
     summary = result["summary"]
 
-    ws = wb.create_sheet(_safe_sheet_title(title))
-    ws["A1"] = f"EARLY WARNING - {meta.get('periodLabel') or meta['pairLabel']}"
-    ws["A1"].font = Font(size=16, bold=True, color="FFFFFF")
-    ws["A1"].fill = PatternFill(start_color="C00000", end_color="C00000", fill_type="solid")
-    ws.merge_cells("A1:D1")
-
-    ws["A3"] = "MÉTRICAS PRINCIPALES"
-    ws["A3"].font = Font(size=12, bold=True)
+    ws = book.add_sheet(title)
+    ws.merge_range("A1:D1", f"EARLY WARNING - {meta.get('periodLabel') or meta['pairLabel']}", book.title)
+    ws.write("A3", "MÉTRICAS PRINCIPALES", book.section)
 
+    # El formato de cada métrica se fija aquí, no comparando etiquetas dentro del bucle.
+    total_var_pct = summary["totalVarPct"]
     metrics = [
-        ["Facturación año anterior:", summary["totalPrev"]],
-        ["Facturación año actual:", summary["totalCurr"]],
-        ["Variación absoluta:", summary["totalVar"]],
-        ["Variación %:", summary["totalVarPct"]],
-        ["", ""],
-        [f"Alertas (caídas >{abs(meta['alertThreshold'])}%):", summary["alertsCount"]],
-        ["Impacto alertas:", summary["alertsImpact"]],
-        ["Hoteles nuevos:", summary["newCount"]],
-        ["Hoteles perdidos:", summary["lostCount"]],
+        ("Facturación año anterior:", summary["totalPrev"], book.eur),
+        ("Facturación año actual:", summary["totalCurr"], book.eur),
+        ("Variación absoluta:", summary["totalVar"], book.eur),
+        ("Variación %:", total_var_pct / 100 if isinstance(total_var_pct, (int, float)) else total_var_pct, book.pct),
+        ("", None, None),
+        (f"Alertas (caídas >{abs(meta['alertThreshold'])}%):", summary["alertsCount"], book.eur),
+        ("Impacto alertas:", summary["alertsImpact"], book.eur),
+        ("Hoteles nuevos:", summary["newCount"], book.eur),
+        ("Hoteles perdidos:", summary["lostCount"], book.eur),
     ]
 
-    for i, (label, value) in enumerate(metrics, 4):
-        ws[f"A{i}"] = label
-        ws[f"B{i}"] = value
-        if isinstance(value, (int, float)) and value != "":
-            if "variación %" in label.lower():
-                ws[f"B{i}"].number_format = "0.0%"
-                ws[f"B{i}"].value = value / 100
-            else:
-                ws[f"B{i}"].number_format = "#,##0.00€"
-
-
-
+    for r_idx, (label, value, fmt) in enumerate(metrics, 3):
+        ws.write(r_idx, 0, label)
+        if isinstance(value, (int, float)):
+            ws.write_number(r_idx, 1, value, fmt)
+        else:
+            ws.write(r_idx, 1, value)
 
-def _write_clusters_sheet(wb, result: Dict, title: str, rows: List[Dict], label_key: str):
-    from openpyxl.styles import Font, PatternFill
 
-    ws = wb.create_sheet(_safe_sheet_title(title))
+def _write_clusters_sheet(book: _ReportBook, result: Dict, title: str, rows: List[Dict], label_key: str):
+    ws = book.add_sheet(title)
     headers = [label_key, result["meta"]["previousLabel"], result["meta"]["latestLabel"], "Variación €", "Variación %"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="4A5568", end_color="4A5568", fill_type="solid")
-
-    for r_idx, row in enumerate(rows, 2):
-        values = [
-            row.get(label_key),
-            row.get("Prev"),
-            row.get("Curr"),
-            row.get("VarAbs"),
-            row.get("VarPct"),
-        ]
-        for c_idx, value in enumerate(values, 1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=value)
-            if c_idx in [2, 3, 4]:
-                cell.number_format = "#,##0.00€"
-            elif c_idx == 5:
-                cell.number_format = "0.0%"
-                if value is not None:
-                    cell.value = value / 100
-
-    for col in ["A", "B", "C", "D", "E"]:
-        ws.column_dimensions[col].width = 20
-
-
-def _write_churn_sheet(wb, result: Dict, title: str):
-    from openpyxl.styles import Font, PatternFill
-
-    ws = wb.create_sheet(_safe_sheet_title(title))
-    headers = ["Hotel", "Ubicación", "Meses sin ventas"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="9B2C2C", end_color="9B2C2C", fill_type="solid")
-
-    for r_idx, row in enumerate(result.get("churn", []), 2):
-        ws.cell(row=r_idx, column=1, value=row.get("Cliente"))
-        ws.cell(row=r_idx, column=2, value=row.get("Ubicacion"))
-        ws.cell(row=r_idx, column=3, value=row.get("MonthsInactive"))
-
-    ws.column_dimensions["A"].width = 50
-    ws.column_dimensions["B"].width = 20
-    ws.column_dimensions["C"].width = 18
-
-
-def _write_cohorts_sheet(wb, result: Dict, title: str, metric: str):
-    from openpyxl.styles import Font, PatternFill
-
-    ws = wb.create_sheet(_safe_sheet_title(title))
+    ws.write_row(0, 0, headers, book.header("4A5568"))
+    # El formato de columna se aplica a toda celda escrita sin formato propio.
+    ws.set_column(0, 0, 20)
+    ws.set_column(1, 3, 20, book.eur)
+    ws.set_column(4, 4, 20, book.pct)
+
+    write_row = ws.write_row
+    for r_idx, row in enumerate(rows, 1):
+        get = row.get
+        var_pct = get("VarPct")
+        write_row(r_idx, 0, [
+            get(label_key),
+            get("Prev"),
+            get("Curr"),
+            get("VarAbs"),
+            None if var_pct is None else var_pct / 100,
+        ])
+
+
+def _write_churn_sheet(book: _ReportBook, result: Dict, title: str):
+    ws = book.add_sheet(title)
+    ws.write_row(0, 0, ["Hotel", "Ubicación", "Meses sin ventas"], book.header("9B2C2C"))
+    ws.set_column(0, 0, 50)
+    ws.set_column(1, 1, 20)
+    ws.set_column(2, 2, 18)
+
+    write_row = ws.write_row
+    for r_idx, row in enumerate(result.get("churn", []), 1):
+        get = row.get
+        write_row(r_idx, 0, [get("Cliente"), get("Ubicacion"), get("MonthsInactive")])
+
+
+def _write_cohorts_sheet(book: _ReportBook, result: Dict, title: str, metric: str):
+    ws = book.add_sheet(title)
     columns = ["Cohorte", "Tamaño"] + (result.get("cohorts", {}).get("columns") or [])
-    for col, header in enumerate(columns, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="2D3748", end_color="2D3748", fill_type="solid")
+    ws.write_row(0, 0, columns, book.header("2D3748"))
+    ws.set_column(0, 0, 18)
+    ws.set_column(1, 1, 10)
+    if len(columns) > 2:
+        ws.set_column(2, len(columns) - 1, 10, book.pct)
 
     rows = result.get("cohorts", {}).get("rows") or []
-    for r_idx, row in enumerate(rows, 2):
-        ws.cell(row=r_idx, column=1, value=row.get("cohort"))
-        ws.cell(row=r_idx, column=2, value=row.get("size"))
+    write_row = ws.write_row
+    for r_idx, row in enumerate(rows, 1):
         values = row.get(metric) or []
-        for c_idx, val in enumerate(values, 3):
-            cell = ws.cell(row=r_idx, column=c_idx, value=val)
-            if val is not None:
-                cell.number_format = "0.0%"
-                cell.value = val / 100
-
-    ws.column_dimensions["A"].width = 18
-    ws.column_dimensions["B"].width = 10
-    for col in range(3, len(columns) + 1):
-        ws.column_dimensions[chr(64 + col)].width = 10
-def _write_table_sheet(wb, result: Dict, title: str, rows: List[Dict], header_color: str):
-    from openpyxl.styles import Font, PatternFill
+        write_row(r_idx, 0, [row.get("cohort"), row.get("size")] + [None if val is None else val / 100 for val in values])
 
+
+def _write_table_sheet(book: _ReportBook, result: Dict, title: str, rows: List[Dict], header_color: str):
     meta = result["meta"]
     latest_label = meta["latestLabel"]
     previous_label = meta["previousLabel"]
@@ -1143,96 +1577,92 @@ def _write_table_sheet(wb, result: Dict, title: str, rows: List[Dict], header_co
         "Variación %",
     ]
 
-    ws = wb.create_sheet(_safe_sheet_title(title))
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color=header_color, end_color=header_color, fill_type="solid")
-
-    for r_idx, row in enumerate(rows, 2):
-        values = [
-            row.get("Cliente"),
-            row.get("HotelCode"),
-            row.get("Ubicacion"),
-            row.get("Prev"),
-            row.get("Curr"),
-            row.get("VarAbs"),
-            row.get("VarPct"),
-        ]
-        for c_idx, value in enumerate(values, 1):
-            cell = ws.cell(row=r_idx, column=c_idx, value=value)
-            if c_idx in [4, 5, 6]:
-                cell.number_format = "#,##0.00€"
-            elif c_idx == 7:
-                cell.number_format = "0.0%"
-                if value is not None:
-                    cell.value = value / 100
-
-    ws.column_dimensions["A"].width = 50
-    ws.column_dimensions["B"].width = 25
-    ws.column_dimensions["C"].width = 15
-    for col in ["D", "E", "F", "G"]:
-        ws.column_dimensions[col].width = 15
-
-
-def _write_intelligent_sheet(wb, result: Dict, title: str):
-    from openpyxl.styles import Font, PatternFill
-
-    ws = wb.create_sheet(_safe_sheet_title(title))
-    headers = ["Tipo", "Hotel", "Ubicación", "Mes actual %", "Mes previo %"]
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="3F3D56", end_color="3F3D56", fill_type="solid")
-
-    row_idx = 2
-    for item in result.get("intelligentAlerts", {}).get("persistent", []):
-        ws.cell(row=row_idx, column=1, value="Persistente")
-        ws.cell(row=row_idx, column=2, value=item.get("Cliente"))
-        ws.cell(row=row_idx, column=3, value=item.get("Ubicacion"))
-        ws.cell(row=row_idx, column=4, value=item.get("VarPctLast"))
-        ws.cell(row=row_idx, column=5, value=item.get("VarPctPrev"))
-        row_idx += 1
-
-    for item in result.get("intelligentAlerts", {}).get("recovery", []):
-        ws.cell(row=row_idx, column=1, value="Recuperación")
-        ws.cell(row=row_idx, column=2, value=item.get("Cliente"))
-        ws.cell(row=row_idx, column=3, value=item.get("Ubicacion"))
-        ws.cell(row=row_idx, column=4, value=item.get("VarPctLast"))
-        ws.cell(row=row_idx, column=5, value=item.get("VarPctPrev"))
-        row_idx += 1
-
-    for col in ["A", "B", "C", "D", "E"]:
-        ws.column_dimensions[col].width = 22
-
-
-def _build_workbook(result: Dict):
-    from openpyxl import Workbook
-
-    wb = Workbook()
-    wb.remove(wb.active)
-    _write_summary_sheet(wb, result, "Resumen Ejecutivo")
-    _write_table_sheet(wb, result, "Alertas", result["tables"]["alerts"], "C00000")
-    _write_table_sheet(wb, result, "Crecimientos", result["tables"]["growth"], "006100")
-    if result.get("intelligentAlerts"):
-        _write_intelligent_sheet(wb, result, "Inteligentes")
-    if result.get("clusters"):
-        _write_clusters_sheet(wb, result, "Clusters", result["clusters"]["byCluster"], "Cluster")
-        if result["clusters"].get("byCountry"):
-            _write_clusters_sheet(wb, result, "Paises", result["clusters"]["byCountry"], "Country")
-        _write_table_sheet(wb, result, "Area Comercial", result["clusters"]["byArea"], "6B7280")
-    if result.get("churn") is not None:
-        _write_churn_sheet(wb, result, "Churn")
-    if result.get("cohorts"):
-        _write_cohorts_sheet(wb, result, "Cohortes Activos", "active")
-        _write_cohorts_sheet(wb, result, "Cohortes Revenue", "revenue")
-    return wb
+    ws = book.add_sheet(title)
+    ws.write_row(0, 0, headers, book.header(header_color))
+    ws.set_column(0, 0, 50)
+    ws.set_column(1, 1, 25)
+    ws.set_column(2, 2, 15)
+    ws.set_column(3, 5, 15, book.eur)
+    ws.set_column(6, 6, 15, book.pct)
+
+    write_row = ws.write_row
+    for r_idx, values in enumerate(book.table_values(rows), 1):
+        write_row(r_idx, 0, values)
+
+
+def _write_intelligent_sheet(book: _ReportBook, result: Dict, title: str):
+    ws = book.add_sheet(title)
+    ws.write_row(0, 0, ["Tipo", "Hotel", "Ubicación", "Mes actual %", "Mes previo %"], book.header("3F3D56"))
+    ws.set_column(0, 4, 22)
+
+    write_row = ws.write_row
+    r_idx = 1
+    for kind, label in (("persistent", "Persistente"), ("recovery", "Recuperación")):
+        for item in result.get("intelligentAlerts", {}).get(kind, []):
+            get = item.get
+            write_row(r_idx, 0, [label, get("Cliente"), get("Ubicacion"), get("VarPctLast"), get("VarPctPrev")])
+            r_idx += 1
+
+
+def _build_workbook(result: Dict, target) -> None:
+    book = _ReportBook(target)
+    _write_summary_sheet(book, result, "Resumen Ejecutivo")
+    # Las secciones sin filas no generan hoja (solo tendrían la cabecera).
+    if result["tables"]["alerts"]:
+        _write_table_sheet(book, result, "Alertas", result["tables"]["alerts"], "C00000")
+    if result["tables"]["growth"]:
+        _write_table_sheet(book, result, "Crecimientos", result["tables"]["growth"], "006100")
+    if any((result.get("intelligentAlerts") or {}).values()):
+        _write_intelligent_sheet(book, result, "Inteligentes")
+    clusters = result.get("clusters") or {}
+    if clusters.get("byCluster"):
+        _write_clusters_sheet(book, result, "Clusters", clusters["byCluster"], "Cluster")
+    if clusters.get("byCountry"):
+        _write_clusters_sheet(book, result, "Paises", clusters["byCountry"], "Country")
+    if clusters.get("byArea"):
+        _write_table_sheet(book, result, "Area Comercial", clusters["byArea"], "6B7280")
+    if result.get("churn"):
+        _write_churn_sheet(book, result, "Churn")
+    if (result.get("cohorts") or {}).get("rows"):
+        _write_cohorts_sheet(book, result, "Cohortes Activos", "active")
+        _write_cohorts_sheet(book, result, "Cohortes Revenue", "revenue")
+    book.close()
+
+
+_RESULT_CACHE: "OrderedDict[Tuple, Dict]" = OrderedDict()
+_RESULT_CACHE_MAX = 32
+_RESULT_CACHE_LOCK = threading.Lock()
+# Motivos de resumen heurístico que se repetirían en cada llamada (sin fallo o sin API key configurada)
+_STABLE_LLM_FALLBACKS = frozenset({None, "missing_gemini_api_key"})
+
+
+def analyze_yoy_cached(file_bytes: bytes, filename: str, file_key: Optional[bytes] = None, **params) -> Dict:
+    # Repetir una petición (volver a un filtro en la UI, exportar tras analizar) reutiliza el resultado.
+    # El dict devuelto se comparte entre llamadas: no debe modificarse.
+    file_key = file_key or _file_key(file_bytes)
+    key = (file_key, filename, tuple(sorted(params.items())))
+    with _RESULT_CACHE_LOCK:
+        cached = _RESULT_CACHE.get(key)
+        if cached is not None:
+            _RESULT_CACHE.move_to_end(key)
+            return cached
+    result = analyze_yoy(file_bytes, filename, file_key=file_key, **params)
+    if result.get("aiSummary", {}).get("llmFallbackReason") not in _STABLE_LLM_FALLBACKS:
+        # Fallo transitorio de Gemini (timeout, error HTTP, respuesta ilegible): no se cachea,
+        # así la siguiente petición vuelve a intentar el resumen.
+        return result
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[key] = result
+        _RESULT_CACHE.move_to_end(key)
+        while len(_RESULT_CACHE) > _RESULT_CACHE_MAX:
+            _RESULT_CACHE.popitem(last=False)
+    return result
 
 
 def build_excel_report(
     file_bytes: bytes,
     filename: str,
-    output_path: str,
+    output_path: Union[str, BinaryIO],
     mode: str = "month",
     month_key: Optional[str] = None,
     search: Optional[str] = None,
@@ -1241,8 +1671,9 @@ def build_excel_report(
     impact_max: Optional[float] = None,
     var_min: Optional[float] = None,
     var_max: Optional[float] = None,
-) -> Tuple[str, Dict]:
-    result = analyze_yoy(
+) -> Tuple[Union[str, BinaryIO], Dict]:
+    # output_path admite también un fichero abierto en binario (p. ej. un SpooledTemporaryFile).
+    result = analyze_yoy_cached(
         file_bytes,
         filename,
         mode=mode,
@@ -1254,8 +1685,7 @@ def build_excel_report(
         var_min=var_min,
         var_max=var_max,
     )
-    wb = _build_workbook(result)
-    wb.save(output_path)
+    _build_workbook(result, output_path)
     return output_path, result
 
 
@@ -1271,11 +1701,11 @@ def build_excel_report_bytes(
     var_min: Optional[float] = None,
     var_max: Optional[float] = None,
 ) -> Tuple[bytes, Dict]:
-    from io import BytesIO
-
-    result = analyze_yoy(
+    buffer = BytesIO()
+    _, result = build_excel_report(
         file_bytes,
         filename,
+        buffer,
         mode=mode,
         month_key=month_key,
         search=search,
@@ -1285,45 +1715,37 @@ def build_excel_report_bytes(
         var_min=var_min,
         var_max=var_max,
     )
-    wb = _build_workbook(result)
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    return buffer.read(), result
+    return buffer.getvalue(), result
 
 
-def build_excel_report_bytes_multi(
+_MODE_CODES = {"month": "M", "ytd": "YTD", "rolling3": "R3", "rolling6": "R6"}
+
+
+def _mode_tag(meta: Dict) -> str:
+    mode = meta.get("mode", "month")
+    return f"{_MODE_CODES.get(mode) or mode[:3].upper()}-{meta.get('monthKey', 'period')}"
+
+
+def build_excel_report_multi(
     file_bytes: bytes,
     filename: str,
     requests: List[Dict],
+    output_path: Union[str, BinaryIO],
     search: Optional[str] = None,
     location: Optional[str] = None,
     impact_min: Optional[float] = None,
     impact_max: Optional[float] = None,
     var_min: Optional[float] = None,
     var_max: Optional[float] = None,
-) -> bytes:
-    from openpyxl import Workbook
-    wb = Workbook()
-    wb.remove(wb.active)
-
-    def _mode_tag(meta: Dict) -> str:
-        mode = meta.get("mode", "month")
-        mode_code = {
-            "month": "M",
-            "ytd": "YTD",
-            "rolling3": "R3",
-            "rolling6": "R6",
-        }.get(mode, mode[:3].upper())
-        key = meta.get("monthKey", "period")
-        return f"{mode_code}-{key}"
-
-    for req in requests:
-        result = analyze_yoy(
-            file_bytes,
-            filename,
-            mode=req.get("mode", "month"),
-            month_key=req.get("monthKey"),
+) -> Union[str, BinaryIO]:
+    book = _ReportBook(output_path)
+
+    # Peticiones repetidas (mismo modo y mes con distinta etiqueta) reutilizan el análisis.
+    keys = list(dict.fromkeys((req.get("mode", "month"), req.get("monthKey")) for req in requests))
+    params = [
+        dict(
+            mode=mode,
+            month_key=month_key,
             search=search,
             location=location,
             impact_min=impact_min,
@@ -1331,22 +1753,56 @@ def build_excel_report_bytes_multi(
             var_min=var_min,
             var_max=var_max,
         )
+        for mode, month_key in keys
+    ]
+    # El fichero se hashea una sola vez para todos los análisis del informe.
+    file_key = _file_key(file_bytes)
+    results = {key: analyze_yoy_cached(file_bytes, filename, file_key, **p) for key, p in zip(keys, params)}
+
+    for req in requests:
+        result = results[(req.get("mode", "month"), req.get("monthKey"))]
         tag = req.get("label") or _mode_tag(result["meta"])
-        _write_summary_sheet(wb, result, f"Resumen {tag}")
-        _write_table_sheet(wb, result, f"Alertas {tag}", result["tables"]["alerts"], "C00000")
-        _write_table_sheet(wb, result, f"Crec {tag}", result["tables"]["growth"], "006100")
-        if result.get("clusters"):
-            _write_clusters_sheet(wb, result, f"Clusters {tag}", result["clusters"]["byCluster"], "Cluster")
-        if result.get("churn") is not None:
-            _write_churn_sheet(wb, result, f"Churn {tag}")
-        if result.get("cohorts"):
-            _write_cohorts_sheet(wb, result, f"Cohortes A {tag}", "active")
-            _write_cohorts_sheet(wb, result, f"Cohortes R {tag}", "revenue")
-
-    from io import BytesIO
+        _write_summary_sheet(book, result, f"Resumen {tag}")
+        if result["tables"]["alerts"]:
+            _write_table_sheet(book, result, f"Alertas {tag}", result["tables"]["alerts"], "C00000")
+        if result["tables"]["growth"]:
+            _write_table_sheet(book, result, f"Crec {tag}", result["tables"]["growth"], "006100")
+        if (result.get("clusters") or {}).get("byCluster"):
+            _write_clusters_sheet(book, result, f"Clusters {tag}", result["clusters"]["byCluster"], "Cluster")
+        if result.get("churn"):
+            _write_churn_sheet(book, result, f"Churn {tag}")
+        if (result.get("cohorts") or {}).get("rows"):
+            _write_cohorts_sheet(book, result, f"Cohortes A {tag}", "active")
+            _write_cohorts_sheet(book, result, f"Cohortes R {tag}", "revenue")
+
+    book.close()
+    return output_path
+
+
+def build_excel_report_bytes_multi(
+    file_bytes: bytes,
+    filename: str,
+    requests: List[Dict],
+    search: Optional[str] = None,
+    location: Optional[str] = None,
+    impact_min: Optional[float] = None,
+    impact_max: Optional[float] = None,
+    var_min: Optional[float] = None,
+    var_max: Optional[float] = None,
+) -> bytes:
     buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    return buffer.read()
+    build_excel_report_multi(
+        file_bytes,
+        filename,
+        requests,
+        buffer,
+        search=search,
+        location=location,
+        impact_min=impact_min,
+        impact_max=impact_max,
+        var_min=var_min,
+        var_max=var_max,
+    )
+    return buffer.getvalue()
 
 
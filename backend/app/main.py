@@ -11,28 +11,39 @@ from functools import partial
 from dotenv import load_dotenv
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import logging
-import math
-import json
+
+import orjson
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
 logger = logging.getLogger("early_warning")
 
+# orjson serializa NaN/Inf como null y los escalares de numpy de forma nativa,
+# así que el resultado del análisis se devuelve sin recorrerlo en Python.
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _json_response(value) -> Response:
+    return Response(content=orjson.dumps(value, option=_ORJSON_OPTIONS), media_type="application/json")
+
+
+_REPORT_SPOOL_MAX = 16 << 20
+_STREAM_CHUNK = 64 << 10
+
+
+def _iter_file(handle):
+    try:
+        while chunk := handle.read(_STREAM_CHUNK):
+            yield chunk
+    finally:
+        handle.close()
 
-def _sanitize_json(value):
-    if isinstance(value, dict):
-        return {k: _sanitize_json(v) for k, v in value.items()}
-    if isinstance(value, list):
-        return [_sanitize_json(v) for v in value]
-    if isinstance(value, float):
-        return value if math.isfinite(value) else None
-    return value
 
-from .analysis import AnalysisError, analyze_yoy, build_excel_report_bytes, build_excel_report_bytes_multi
-from .netsuite_client import get_netsuite_client, NetSuiteError, dataframe_to_excel_format
+from .analysis import AnalysisError, analyze_yoy_cached, analyze_yoy_df, build_excel_report, build_excel_report_multi
+from .netsuite_client import get_netsuite_client, NetSuiteError
 
 app = FastAPI(title="Early Warning YoY")
 
@@ -75,13 +86,15 @@ async def analyze(
     persist_threshold: Optional[float] = Form(None),
     recovery_threshold: Optional[float] = Form(None),
     churn_months: Optional[int] = Form(9),
+    include_churn: Optional[bool] = Form(True),
+    include_cohorts: Optional[bool] = Form(True),
 ):
     try:
         file_bytes = await file.read()
         logger.info(f"Starting analysis for file: {file.filename}")
         loop = asyncio.get_event_loop()
         analyze_task = partial(
-            analyze_yoy,
+            analyze_yoy_cached,
             file_bytes,
             file.filename,
             alert_threshold=alert_threshold or -30.0,
@@ -96,13 +109,15 @@ async def analyze(
             persist_threshold=persist_threshold,
             recovery_threshold=recovery_threshold,
             churn_months=churn_months or 9,
+            include_churn=include_churn is not False,
+            include_cohorts=include_cohorts is not False,
         )
         result = await loop.run_in_executor(executor, analyze_task)
         logger.info(f"Analysis completed for {file.filename}")
         if compare_mode:
             loop = asyncio.get_event_loop()
             compare_task = partial(
-                analyze_yoy,
+                analyze_yoy_cached,
                 file_bytes,
                 file.filename,
                 alert_threshold=alert_threshold or -30.0,
@@ -117,11 +132,13 @@ async def analyze(
                 persist_threshold=persist_threshold,
                 recovery_threshold=recovery_threshold,
                 churn_months=churn_months or 9,
+                include_churn=include_churn is not False,
+                include_cohorts=include_cohorts is not False,
             )
             compare = await loop.run_in_executor(executor, compare_task)
             logger.info(f"Analysis completed for {file.filename}")
-            result["compare"] = compare
-        return JSONResponse(content=_sanitize_json(result))
+            result = {**result, "compare": compare}
+        return _json_response(result)
     except AnalysisError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     except Exception as exc:
@@ -143,14 +160,18 @@ async def report_excel(
     var_min: Optional[float] = Form(None),
     var_max: Optional[float] = Form(None),
 ):
+    # El libro se escribe en un fichero temporal (en memoria hasta 16 MB) y se envía por bloques.
+    target = tempfile.SpooledTemporaryFile(max_size=_REPORT_SPOOL_MAX)
     try:
         file_bytes = await file.read()
         if export_modes:
-            requests = json.loads(export_modes)
-            content = build_excel_report_bytes_multi(
+            requests = orjson.loads(export_modes)
+            report_task = partial(
+                build_excel_report_multi,
                 file_bytes,
                 file.filename,
                 requests,
+                target,
                 search=search,
                 location=location,
                 impact_min=impact_min,
@@ -159,9 +180,11 @@ async def report_excel(
                 var_max=var_max,
             )
         else:
-            content, _ = build_excel_report_bytes(
+            report_task = partial(
+                build_excel_report,
                 file_bytes,
                 file.filename,
+                target,
                 mode=(mode or "month"),
                 month_key=month_key,
                 search=search,
@@ -171,14 +194,20 @@ async def report_excel(
                 var_min=var_min,
                 var_max=var_max,
             )
-        return Response(
-            content=content,
+        # El análisis (incluida la llamada a Gemini) y la escritura del libro no bloquean el event loop.
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(executor, report_task)
+        target.seek(0)
+        return StreamingResponse(
+            _iter_file(target),
             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             headers={"Content-Disposition": "attachment; filename=Early_Warning_YoY.xlsx"},
         )
     except AnalysisError as exc:
+        target.close()
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     except Exception as exc:
+        target.close()
         logger.exception("Error inesperado en /api/report/excel")
         raise HTTPException(status_code=500, detail=f"Error inesperado: {exc}") from exc
 
@@ -199,6 +228,8 @@ async def analyze_netsuite(
     persist_threshold: Optional[float] = Form(None),
     recovery_threshold: Optional[float] = Form(None),
     churn_months: Optional[int] = Form(9),
+    include_churn: Optional[bool] = Form(True),
+    include_cohorts: Optional[bool] = Form(True),
     start_date: Optional[str] = Form(None),
     end_date: Optional[str] = Form(None),
 ):
@@ -221,12 +252,17 @@ async def analyze_netsuite(
                 detail=f"Configuración de NetSuite incompleta: {exc}"
             ) from exc
 
-        # Obtener datos desde NetSuite
+        # Obtener datos desde NetSuite (petición bloqueante: fuera del event loop)
+        loop = asyncio.get_event_loop()
         try:
-            df = ns_client.fetch_sales_data(
+            # Columnas Arrow: texto y números sin columnas object, mismo resultado de análisis
+            fetch_task = partial(
+                ns_client.fetch_sales_data,
                 start_date=start_date,
                 end_date=end_date,
+                backend="arrow",
             )
+            df = await loop.run_in_executor(executor, fetch_task)
 
             if df.empty:
                 raise HTTPException(
@@ -234,9 +270,6 @@ async def analyze_netsuite(
                     detail="NetSuite no devolvió datos. Verifica los filtros o el RESTlet."
                 )
 
-            # Convertir DataFrame a bytes de Excel para reutilizar analyze_yoy
-            file_bytes = dataframe_to_excel_format(df)
-
         except NetSuiteError as exc:
             logger.error(f"Error al consultar NetSuite: {exc}")
             raise HTTPException(
@@ -244,14 +277,12 @@ async def analyze_netsuite(
                 detail=f"Error al conectar con NetSuite: {exc}"
             ) from exc
 
-        # Usar la misma lógica de análisis que el endpoint original
-        source_filename = "netsuite_export.xlsx"
-        logger.info(f"Starting analysis for file: {source_filename}")
-        loop = asyncio.get_event_loop()
+        # Misma lógica de análisis que el endpoint original, directamente sobre el DataFrame (sin pasar por Excel)
+        source_name = "netsuite"
+        logger.info(f"Starting analysis for source: {source_name}")
         analyze_task = partial(
-            analyze_yoy,
-            file_bytes,
-            source_filename,
+            analyze_yoy_df,
+            df,
             alert_threshold=alert_threshold or -30.0,
             mode=(mode or "month"),
             month_key=month_key,
@@ -264,17 +295,18 @@ async def analyze_netsuite(
             persist_threshold=persist_threshold,
             recovery_threshold=recovery_threshold,
             churn_months=churn_months or 9,
+            include_churn=include_churn is not False,
+            include_cohorts=include_cohorts is not False,
         )
         result = await loop.run_in_executor(executor, analyze_task)
-        logger.info(f"Analysis completed for {source_filename}")
+        logger.info(f"Analysis completed for {source_name}")
 
         # Si hay modo de comparación, ejecutarlo
         if compare_mode:
             loop = asyncio.get_event_loop()
             compare_task = partial(
-                analyze_yoy,
-                file_bytes,
-                source_filename,
+                analyze_yoy_df,
+                df,
                 alert_threshold=alert_threshold or -30.0,
                 mode=compare_mode,
                 month_key=compare_month_key,
@@ -287,12 +319,14 @@ async def analyze_netsuite(
                 persist_threshold=persist_threshold,
                 recovery_threshold=recovery_threshold,
                 churn_months=churn_months or 9,
+                include_churn=include_churn is not False,
+                include_cohorts=include_cohorts is not False,
             )
             compare = await loop.run_in_executor(executor, compare_task)
-            logger.info(f"Analysis completed for {source_filename}")
-            result["compare"] = compare
+            logger.info(f"Analysis completed for {source_name}")
+            result = {**result, "compare": compare}
 
-        return JSONResponse(content=_sanitize_json(result))
+        return _json_response(result)
 
     except AnalysisError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
@@ -310,7 +344,8 @@ async def test_netsuite():
     """
     try:
         ns_client = get_netsuite_client()
-        result = ns_client.test_connection()
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(executor, ns_client.test_connection)
         if result["success"]:
             return JSONResponse(content=result)
         else:
@@ -4,23 +4,196 @@ Cliente de NetSuite para conexión via RESTlet con autenticación TBA (OAuth 1.0
 from __future__ import annotations
 
 import os
-import json
 import logging
-from typing import Dict, List, Optional
-from urllib.parse import urljoin
-
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Literal, Optional, Tuple
+
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth1
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
 
+try:
+    import ijson
+
+    _HAS_IJSON = True
+except ImportError:  # pragma: no cover - depende del entorno
+    _HAS_IJSON = False
+
 logger = logging.getLogger("netsuite_client")
 
+# Caché de respuestas del RESTlet por parámetros: pocas entradas (los DataFrames pesan) y caducidad corta
+_FETCH_CACHE_MAX = 32
+_FETCH_CACHE_TTL = 300.0
+
+# Tamaño máximo (descomprimido) de una respuesta del RESTlet: por encima se aborta la descarga
+_MAX_RESPONSE_BYTES = 256 * 1024 * 1024
+
+# Tiempo máximo de espera por respuesta del RESTlet (las consultas grandes tardan)
+_REQUEST_TIMEOUT = 120.0
+
+# Intervalo mínimo entre regeneraciones de la firma OAuth tras un 401 (evita tormentas de refresco)
+_AUTH_REFRESH_INTERVAL = 30.0
+
 
 class NetSuiteError(Exception):
     """Error de conexión o consulta a NetSuite"""
     pass
 
 
+_INVALID_PAYLOAD = "El RESTlet no devolvió datos válidos (esperado: array de objetos)"
+_REQUIRED_COLS = frozenset({"Cliente"})
+
+# Columnas de texto candidatas a category (códigos enteros + diccionario de valores)
+_CATEGORY_COLS = ("Cliente", "Hotel - Code", "Ubicación")
+
+# Tipos declarados de las columnas fijas del RESTlet; los meses (nombres variables) van a float64
+NETSUITE_DTYPES: Dict[str, str] = {
+    "Cliente": "string",
+    "Hotel - Code": "string",
+    "Ubicación": "string",
+}
+
+
+def _records_to_columns(records: Iterable) -> Dict[str, List]:
+    """
+    Vuelca los registros del RESTlet (array de objetos JSON) en listas por columna
+
+    Las claves ausentes en un registro quedan como None, igual que con pd.DataFrame(registros).
+    Las columnas requeridas se validan con el primer registro, antes de leer el resto.
+    """
+    columns: Dict[str, List] = {}
+    count = 0
+    for record in records:
+        if not isinstance(record, dict):
+            raise NetSuiteError(_INVALID_PAYLOAD)
+        if not count:
+            missing = sorted(_REQUIRED_COLS - record.keys())
+            if missing:
+                raise NetSuiteError(
+                    f"El RESTlet no devolvió las columnas requeridas. Faltantes: {missing}. "
+                    f"Columnas recibidas: {list(record)}"
+                )
+        for key, value in record.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * count
+            column.append(value)
+        count += 1
+        if len(record) < len(columns):
+            for column in columns.values():
+                if len(column) < count:
+                    column.append(None)
+    return columns
+
+
+_NUMERIC_TYPES = (int, float, type(None))
+_TEXT_TYPES = (str, type(None))
+
+
+def _build_frame(columns: Dict[str, List], dtypes: Dict[str, str]) -> pd.DataFrame:
+    """
+    Construye el DataFrame con tipos conocidos en lugar de inferirlos columna a columna
+
+    Las columnas declaradas en dtypes usan su tipo; un tipo "string" solo se aplica si los valores ya
+    son texto, así un código numérico (5, 12.0) conserva su valor. Las no declaradas que solo traen
+    números JSON (int/float/None, como los meses) pasan directamente a float64; el resto (texto aunque
+    parezca numérico, como "0012", booleanos, listas) se deja a la inferencia de pandas.
+    """
+    data = {}
+    for name, values in columns.items():
+        dtype = dtypes.get(name)
+        if dtype is not None:
+            if dtype == "string" and not all(type(value) in _TEXT_TYPES for value in values):
+                data[name] = values
+            else:
+                data[name] = pd.array(values, dtype=dtype)
+        elif all(type(value) in _NUMERIC_TYPES for value in values):
+            data[name] = np.array(values, dtype=np.float64)
+        else:
+            data[name] = values
+    return pd.DataFrame(data)
+
+
+def _http_error_message(response: requests.Response) -> str:
+    """
+    Mensaje de error para una respuesta HTTP fallida del RESTlet
+
+    Solo se leen los primeros 4 KB del cuerpo (las páginas de error HTML pueden ser grandes) y se
+    decodifican una sola vez: como JSON si lo es, si no como texto.
+    """
+    kind = "Client" if response.status_code < 500 else "Server"
+    error_msg = (
+        f"Error HTTP al consultar NetSuite: {response.status_code} {kind} Error: "
+        f"{response.reason} for url: {response.url}"
+    )
+    with response:
+        body = next(response.iter_content(4096), b"")[:4096]
+    try:
+        error_msg += f"\nDetalle: {orjson.loads(body)}"
+    except orjson.JSONDecodeError:
+        error_msg += f"\nRespuesta: {body.decode('utf-8', errors='replace')[:500]}"
+    return error_msg
+
+
+class _CappedReader:
+    """Lector del cuerpo (ya descomprimido) de una respuesta que falla al superar max_bytes"""
+
+    def __init__(self, response: requests.Response, max_bytes: int):
+        response.raw.decode_content = True
+        self._raw = response.raw
+        self._max_bytes = max_bytes
+        self._read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            # ijson lee 0 bytes para saber si el flujo es binario o texto
+            return b""
+        chunk = self._raw.read(size if size > 0 else None)
+        self._read += len(chunk)
+        if self._read > self._max_bytes:
+            raise NetSuiteError(_too_large_message(self._max_bytes))
+        return chunk
+
+
+def _too_large_message(max_bytes: int) -> str:
+    return f"La respuesta del RESTlet supera el tamaño máximo permitido ({max_bytes / 1024 / 1024:.0f} MB)"
+
+
+def _read_body(response: requests.Response, max_bytes: int) -> bytes:
+    # Descarga por bloques con límite: una respuesta desmesurada falla antes de agotar la memoria
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise NetSuiteError(_too_large_message(max_bytes))
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=1 << 16):
+        body += chunk
+        if len(body) > max_bytes:
+            raise NetSuiteError(_too_large_message(max_bytes))
+    return bytes(body)
+
+
+def _categorize(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convierte a category las columnas de texto con valores muy repetidos
+
+    Solo compensa si hay bastantes menos valores distintos que filas: con un hotel por fila,
+    Cliente y Hotel - Code son casi únicos y se dejan como texto.
+    """
+    for col in _CATEGORY_COLS:
+        if col in df.columns and df[col].nunique() * 2 <= len(df):
+            df[col] = df[col].astype("category")
+    return df
+
+
 class NetSuiteClient:
     """
     Cliente para conectar con NetSuite via RESTlet usando Token-Based Authentication (OAuth 1.0a)
@@ -34,6 +207,9 @@ class NetSuiteClient:
         token_id: str,
         token_secret: str,
         restlet_url: Optional[str] = None,
+        dtypes: Optional[Dict[str, str]] = None,
+        max_bytes: int = _MAX_RESPONSE_BYTES,
+        timeout: float = _REQUEST_TIMEOUT,
     ):
         """
         Inicializa el cliente de NetSuite
@@ -45,6 +221,9 @@ class NetSuiteClient:
             token_id: Token ID del usuario
             token_secret: Token Secret del usuario
             restlet_url: URL completa del RESTlet (opcional, se puede construir)
+            dtypes: Tipos de las columnas fijas del RESTlet (por defecto NETSUITE_DTYPES)
+            max_bytes: Tamaño máximo de cada respuesta del RESTlet (por defecto 256 MB)
+            timeout: Segundos de espera por respuesta del RESTlet (por defecto 120)
         """
         self.account = account.replace("_", "-").upper()
         self.consumer_key = consumer_key
@@ -52,13 +231,88 @@ class NetSuiteClient:
         self.token_id = token_id
         self.token_secret = token_secret
         self.restlet_url = restlet_url
+        self.dtypes = dict(NETSUITE_DTYPES if dtypes is None else dtypes)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
 
         # Construir URL base si no se proporciona RESTlet URL
         if not self.restlet_url:
             # Nota: El usuario debe proporcionar la URL completa del RESTlet
             logger.warning("No se proporcionó URL del RESTlet. Debes configurar NS_RESTLET_URL en .env")
 
+        # Sesión persistente: reutiliza la conexión TCP/TLS (keep-alive) y la autenticación entre llamadas
+        self._session = requests.Session()
+        self._oauth = self._build_oauth()
+        self._session.auth = self._oauth
+        self._auth_refreshed_at = -math.inf
+        self._auth_lock = threading.Lock()
+        self._session.headers.update({
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            # Compresión en la respuesta: gzip/deflate y br/zstd si está instalado su descompresor
+            "Accept-Encoding": make_headers(accept_encoding=True)["accept-encoding"],
+        })
+        # Los timeouts de lectura no se reintentan (cada intento puede esperar el timeout completo) y llegan
+        # como Timeout, no como un MaxRetryError envuelto en ConnectionError
+        retries = Retry(
+            total=3,
+            read=False,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16, max_retries=retries)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self._cache: "OrderedDict[bytes, Tuple[float, pd.DataFrame]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _cache_get(self, key: bytes) -> Optional[pd.DataFrame]:
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            stored_at, df = entry
+            if time.monotonic() - stored_at > _FETCH_CACHE_TTL:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return df
+
+    def _cache_set(self, key: bytes, df: pd.DataFrame) -> None:
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic(), df)
+            self._cache.move_to_end(key)
+            while len(self._cache) > _FETCH_CACHE_MAX:
+                self._cache.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Vacía la caché de respuestas del RESTlet"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def close(self) -> None:
+        """Libera las conexiones del pool de la sesión HTTP"""
+        self._session.close()
+
+    def __enter__(self) -> "NetSuiteClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
     def _get_oauth(self) -> OAuth1:
+        """
+        Devuelve el objeto OAuth1 para autenticación TBA (creado una sola vez por cliente)
+
+        Returns:
+            OAuth1: Objeto de autenticación configurado
+        """
+        return self._oauth
+
+    def _build_oauth(self) -> OAuth1:
         """
         Crea el objeto OAuth1 para autenticación TBA
 
@@ -74,11 +328,29 @@ class NetSuiteClient:
             signature_method="HMAC-SHA256",
         )
 
+    def _refresh_oauth(self) -> None:
+        """
+        Regenera la firma OAuth de la sesión tras un 401 (desfase de reloj, sesión caducada)
+
+        La sesión y su pool de conexiones se conservan; como mucho una regeneración por intervalo,
+        aunque varias peticiones concurrentes reciban 401 a la vez.
+        """
+        with self._auth_lock:
+            now = time.monotonic()
+            if now - self._auth_refreshed_at < _AUTH_REFRESH_INTERVAL:
+                return
+            self._auth_refreshed_at = now
+            self._oauth = self._build_oauth()
+            self._session.auth = self._oauth
+            logger.warning("NetSuite respondió 401; se regenera la autenticación OAuth y se reintenta")
+
     def fetch_sales_data(
         self,
         start_date: Optional[str] = None,
         end_date: Optional[str] = None,
         filters: Optional[Dict] = None,
+        use_cache: bool = True,
+        backend: Literal["numpy", "arrow"] = "numpy",
     ) -> pd.DataFrame:
         """
         Obtiene datos de ventas desde NetSuite via RESTlet
@@ -87,6 +359,9 @@ class NetSuiteClient:
             start_date: Fecha inicio (formato YYYY-MM-DD) - opcional
             end_date: Fecha fin (formato YYYY-MM-DD) - opcional
             filters: Filtros adicionales para el RESTlet
+            use_cache: Reutilizar la respuesta de una consulta idéntica reciente (5 minutos)
+            backend: "numpy" (tipos por defecto de pandas) o "arrow" (columnas pd.ArrowDtype: texto
+                y números en memoria Arrow, sin columnas object)
 
         Returns:
             pd.DataFrame: DataFrame con columnas Cliente, Hotel - Code, Ubicación, y meses
@@ -99,6 +374,8 @@ class NetSuiteClient:
                 "No se ha configurado NS_RESTLET_URL. "
                 "Debes proporcionar la URL completa del RESTlet en el archivo .env"
             )
+        if backend not in ("numpy", "arrow"):
+            raise NetSuiteError(f"Backend no soportado: {backend!r} (usa 'numpy' o 'arrow')")
 
         # Preparar parámetros para el RESTlet
         params = {}
@@ -109,68 +386,50 @@ class NetSuiteClient:
         if filters:
             params.update(filters)
 
+        cache_key = (
+            orjson.dumps({"params": params, "backend": backend}, option=orjson.OPT_SORT_KEYS, default=str)
+            if use_cache
+            else None
+        )
+        if cache_key is not None:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                logger.info("Datos de NetSuite servidos desde caché")
+                return cached.copy()
+
         logger.info(f"Consultando RESTlet de NetSuite: {self.restlet_url}")
         logger.debug(f"Parámetros: {params}")
 
         try:
-            # Hacer petición GET al RESTlet con autenticación OAuth
-            response = requests.get(
-                self.restlet_url,
-                auth=self._get_oauth(),
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "application/json",
-                },
-                params=params,
-                timeout=120,  # 2 minutos timeout para queries grandes
-            )
-
-            response.raise_for_status()
-
-            # Parsear respuesta JSON
-            data = response.json()
+            columns = self._fetch_columns(params)
 
             # Validar que tengamos datos
-            if not data or not isinstance(data, list):
-                raise NetSuiteError("El RESTlet no devolvió datos válidos (esperado: array de objetos)")
-
-            if len(data) == 0:
-                logger.warning("El RESTlet devolvió 0 registros")
-                return pd.DataFrame()
+            if not columns:
+                raise NetSuiteError(_INVALID_PAYLOAD)
 
-            # Convertir a DataFrame
-            df = pd.DataFrame(data)
-
-            # Validar columnas requeridas
-            required_cols = ["Cliente"]
-            missing = [col for col in required_cols if col not in df.columns]
-            if missing:
-                raise NetSuiteError(
-                    f"El RESTlet no devolvió las columnas requeridas. Faltantes: {missing}. "
-                    f"Columnas recibidas: {list(df.columns)}"
-                )
+            # Convertir a DataFrame (columna a columna, con tipos declarados); las columnas requeridas ya se validaron
+            df = _build_frame(columns, self.dtypes)
+            if backend == "arrow":
+                df = df.convert_dtypes(dtype_backend="pyarrow")
+            df = _categorize(df)
 
             logger.info(f"✓ Datos obtenidos: {len(df)} registros, {len(df.columns)} columnas")
 
+            if cache_key is not None:
+                self._cache_set(cache_key, df.copy())
             return df
 
-        except requests.exceptions.HTTPError as exc:
-            error_msg = f"Error HTTP al consultar NetSuite: {exc}"
-            try:
-                error_detail = exc.response.json()
-                error_msg += f"\nDetalle: {error_detail}"
-            except Exception:
-                error_msg += f"\nRespuesta: {exc.response.text[:500]}"
-            logger.error(error_msg)
-            raise NetSuiteError(error_msg) from exc
-
-        except requests.exceptions.Timeout as exc:
-            error_msg = "Timeout al consultar NetSuite. El RESTlet tardó más de 2 minutos."
-            logger.error(error_msg)
-            raise NetSuiteError(error_msg) from exc
+        except NetSuiteError as exc:
+            # Errores de validación ya descritos: se propagan sin envolver
+            logger.error(str(exc))
+            raise
 
         except requests.exceptions.RequestException as exc:
-            error_msg = f"Error de conexión con NetSuite: {exc}"
+            # Las respuestas HTTP de error ya llegan como NetSuiteError desde _get
+            if isinstance(exc, requests.exceptions.Timeout):
+                error_msg = f"Timeout al consultar NetSuite. El RESTlet tardó más de {self.timeout:g} segundos."
+            else:
+                error_msg = f"Error de conexión con NetSuite: {exc}"
             logger.error(error_msg)
             raise NetSuiteError(error_msg) from exc
 
@@ -179,6 +438,37 @@ class NetSuiteClient:
             logger.error(error_msg)
             raise NetSuiteError(error_msg) from exc
 
+    def _get(self, params: Dict, stream: bool = False) -> requests.Response:
+        # Hacer petición GET al RESTlet con autenticación OAuth
+        response = self._send(params, stream)
+        if response.status_code == 401:
+            # Un único reintento con la firma regenerada, sobre la misma sesión
+            response.close()
+            self._refresh_oauth()
+            response = self._send(params, stream)
+        if response.status_code >= 400:
+            raise NetSuiteError(_http_error_message(response))
+        return response
+
+    def _send(self, params: Dict, stream: bool) -> requests.Response:
+        return self._session.get(
+            self.restlet_url,
+            params=params,
+            timeout=self.timeout,
+            stream=stream,
+        )
+
+    def _fetch_columns(self, params: Dict) -> Dict[str, List]:
+        with self._get(params, stream=True) as response:
+            if _HAS_IJSON:
+                # Parseo en streaming: los registros pasan a columnas sin materializar el JSON completo
+                reader = _CappedReader(response, self.max_bytes)
+                return _records_to_columns(ijson.items(reader, "item", use_float=True))
+            data = orjson.loads(_read_body(response, self.max_bytes))
+            if not isinstance(data, list):
+                raise NetSuiteError(_INVALID_PAYLOAD)
+            return _records_to_columns(data)
+
     def test_connection(self) -> Dict[str, any]:
         """
         Prueba la conexión con NetSuite
@@ -188,7 +478,7 @@ class NetSuiteClient:
         """
         try:
             # Intentar fetch con límite pequeño para prueba rápida
-            df = self.fetch_sales_data()
+            df = self.fetch_sales_data(use_cache=False)
             return {
                 "success": True,
                 "message": f"Conexión exitosa. {len(df)} registros disponibles.",
@@ -238,6 +528,19 @@ def get_netsuite_client() -> NetSuiteClient:
             "Revisa tu archivo .env"
         )
 
+    return _cached_client(account, consumer_key, consumer_secret, token_id, token_secret, restlet_url)
+
+
+@lru_cache(maxsize=1)
+def _cached_client(
+    account: str,
+    consumer_key: str,
+    consumer_secret: str,
+    token_id: str,
+    token_secret: str,
+    restlet_url: str,
+) -> NetSuiteClient:
+    # Un cliente por configuración: las peticiones sucesivas comparten su sesión y pool de conexiones
     return NetSuiteClient(
         account=account,
         consumer_key=consumer_key,
@@ -246,37 +549,3 @@ def get_netsuite_client() -> NetSuiteClient:
         token_secret=token_secret,
         restlet_url=restlet_url,
     )
-
-
-def dataframe_to_excel_format(df: pd.DataFrame) -> bytes:
-    """
-    Convierte el DataFrame de NetSuite al formato Excel esperado por analyze_yoy
-
-    Args:
-        df: DataFrame con datos de NetSuite
-
-    Returns:
-        bytes: Excel en formato bytes para pasarlo a analyze_yoy
-    """
-    from io import BytesIO
-    from openpyxl import Workbook
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Datos NetSuite"
-
-    # Escribir encabezados
-    headers = list(df.columns)
-    for col_idx, header in enumerate(headers, start=1):
-        ws.cell(row=1, column=col_idx, value=header)
-
-    # Escribir datos
-    for row_idx, row in enumerate(df.values, start=2):
-        for col_idx, value in enumerate(row, start=1):
-            ws.cell(row=row_idx, column=col_idx, value=value)
-
-    # Guardar en bytes
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    return buffer.read()
@@ -0,0 +1,57 @@
+from io import BytesIO
+
+import pandas as pd
+import pytest
+
+MONTHS = ["Ene", "Feb", "Mar"]
+
+# (Cliente, Hotel - Code, Ubicación, ventas mensuales 2023, ventas mensuales 2024)
+HOTELS = [
+    ("Grupo Sol: Hotel Playa", "SOL01", "Madrid", 100.0, 50.0),
+    ("Grupo Sol: Hotel Centro", "SOL02", "Roma", 200.0, 400.0),
+    ("Grupo Mar: Hotel Playa Norte", "MAR01", "Cancun", 400.0, 400.0),
+]
+
+
+def make_frame(*extra) -> pd.DataFrame:
+    rows = []
+    for cliente, code, ubicacion, prev, curr in [*HOTELS, *extra]:
+        row = {"Cliente": cliente, "Hotel - Code": code, "Ubicación": ubicacion}
+        for month in MONTHS:
+            row[f"{month} 2023"] = prev
+            row[f"{month} 2024"] = curr
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def make_xlsx(frame: pd.DataFrame) -> bytes:
+    buffer = BytesIO()
+    frame.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def _no_gemini(monkeypatch):
+    # Los tests no llaman a Gemini: sin API key el resumen usa la heurística.
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+
+
+@pytest.fixture
+def make_sales_frame():
+    # Fábrica: make_sales_frame(*hoteles_extra) añade filas a la muestra base.
+    return make_frame
+
+
+@pytest.fixture
+def to_xlsx():
+    return make_xlsx
+
+
+@pytest.fixture
+def sales_frame() -> pd.DataFrame:
+    return make_frame()
+
+
+@pytest.fixture
+def sales_xlsx(sales_frame) -> bytes:
+    return make_xlsx(sales_frame)
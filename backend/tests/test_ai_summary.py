@@ -0,0 +1,45 @@
+import pytest
+
+from app import analysis
+
+
+@pytest.fixture
+def gemini_calls(monkeypatch):
+    # Gemini simulado: registra las llamadas y falla siempre, así el resumen cae a la heurística.
+    calls = []
+
+    def fake_gemini(*args):
+        calls.append(args)
+        return None, "gemini_unavailable"
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(analysis, "_build_ai_summary_gemini", fake_gemini)
+    return calls
+
+
+def test_quiet_period_skips_llm(sales_frame, gemini_calls):
+    sales_frame["Mar 2024"] = sales_frame["Mar 2023"]
+    result = analysis.analyze_yoy_df(sales_frame)
+    assert result["summary"]["alertsCount"] == 0 and result["summary"]["growthCount"] == 0
+    assert gemini_calls == []
+    assert result["aiSummary"]["llmFallbackReason"] is None
+
+
+def test_period_with_changes_calls_llm(sales_frame, gemini_calls):
+    result = analysis.analyze_yoy_df(sales_frame)
+    assert len(gemini_calls) == 1
+    assert result["aiSummary"]["llmFallbackReason"] == "gemini_unavailable"
+
+
+@pytest.mark.parametrize(
+    ("summary", "quiet"),
+    [
+        ({"alertsCount": 0, "growthCount": 0, "totalVarPct": 0.5}, True),
+        ({"alertsCount": 0, "growthCount": 0, "totalVarPct": -0.99}, True),
+        ({"alertsCount": 0, "growthCount": 0, "totalVarPct": 1.5}, False),
+        ({"alertsCount": 1, "growthCount": 0, "totalVarPct": 0.0}, False),
+        ({"alertsCount": 0, "growthCount": 2, "totalVarPct": 0.0}, False),
+    ],
+)
+def test_is_quiet_period(summary, quiet):
+    assert analysis._is_quiet_period(summary) is quiet
@@ -0,0 +1,42 @@
+from io import BytesIO
+
+import openpyxl
+import pytest
+
+from app.analysis import build_excel_report_bytes, build_excel_report_bytes_multi
+
+
+def _sheets(content: bytes):
+    return openpyxl.load_workbook(BytesIO(content), read_only=True)
+
+
+@pytest.fixture
+def flat_xlsx(sales_frame, to_xlsx):
+    # Marzo 2024 igual a marzo 2023: sin alertas ni crecimientos en el mes.
+    sales_frame["Mar 2024"] = sales_frame["Mar 2023"]
+    return to_xlsx(sales_frame)
+
+
+def test_report_writes_sections_with_rows(sales_xlsx):
+    content, result = build_excel_report_bytes(sales_xlsx, "ventas.xlsx")
+    book = _sheets(content)
+    assert book.sheetnames[0] == "Resumen Ejecutivo"
+    assert {"Alertas", "Crecimientos", "Cohortes Activos", "Cohortes Revenue"} <= set(book.sheetnames)
+    # Cabecera + una fila por alerta
+    assert book["Alertas"].max_row == 1 + len(result["tables"]["alerts"])
+
+
+def test_report_skips_empty_sections(flat_xlsx):
+    content, result = build_excel_report_bytes(flat_xlsx, "ventas.xlsx")
+    assert not result["tables"]["alerts"] and not result["tables"]["growth"] and not result["churn"]
+    names = set(_sheets(content).sheetnames)
+    assert "Resumen Ejecutivo" in names
+    assert not names & {"Alertas", "Crecimientos", "Churn"}
+
+
+def test_multi_report_skips_empty_sections_per_period(flat_xlsx):
+    content = build_excel_report_bytes_multi(flat_xlsx, "ventas.xlsx", [{"mode": "month"}, {"mode": "ytd"}])
+    names = _sheets(content).sheetnames
+    # El mes no tiene variación; el acumulado del año sí (enero y febrero cambian).
+    assert "Resumen M-2024-03" in names and "Alertas M-2024-03" not in names
+    assert {"Alertas YTD-2024-03", "Crec YTD-2024-03"} <= set(names)
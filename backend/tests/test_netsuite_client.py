@@ -0,0 +1,138 @@
+import http.server
+import logging
+import threading
+import time
+
+import orjson
+import pandas as pd
+import pytest
+
+from app.analysis import analyze_yoy_df
+from app.netsuite_client import NetSuiteClient, NetSuiteError
+
+RECORDS = [{"Cliente": "Grupo Sol: Hotel Playa", "Ene 2024": 10}]
+
+
+class _RestletStub(http.server.BaseHTTPRequestHandler):
+    # Responde con los códigos de server.statuses en orden (200 cuando se agotan).
+    def do_GET(self):
+        server = self.server
+        server.auth_headers.append(self.headers.get("Authorization"))
+        time.sleep(server.delay)
+        status = server.statuses.pop(0) if server.statuses else 200
+        body = orjson.dumps(server.records if status == 200 else {"error": "INVALID_LOGIN"})
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def restlet():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _RestletStub)
+    server.statuses = []
+    server.auth_headers = []
+    server.records = RECORDS
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(restlet):
+    url = f"http://127.0.0.1:{restlet.server_port}/restlet"
+    with NetSuiteClient("123_SB1", "ck", "cs", "tid", "ts", restlet_url=url) as ns_client:
+        yield ns_client
+
+
+def _auth_refreshes(caplog) -> int:
+    return sum("se regenera la autenticación" in record.getMessage() for record in caplog.records)
+
+
+def test_401_re_signs_and_retries_once(restlet, client, caplog):
+    restlet.statuses = [401]
+
+    with caplog.at_level(logging.WARNING, logger="netsuite_client"):
+        df = client.fetch_sales_data(use_cache=False)
+
+    assert df["Cliente"].tolist() == [RECORDS[0]["Cliente"]]
+    assert len(restlet.auth_headers) == 2
+    assert all(header and header.startswith("OAuth") for header in restlet.auth_headers)
+    assert _auth_refreshes(caplog) == 1
+
+
+def test_repeated_401_fails_without_looping(restlet, client):
+    restlet.statuses = [401, 401, 401]
+
+    with pytest.raises(NetSuiteError, match="401"):
+        client.fetch_sales_data(use_cache=False)
+    assert len(restlet.auth_headers) == 2
+
+
+def test_oauth_refresh_is_rate_limited(restlet, client, caplog):
+    with caplog.at_level(logging.WARNING, logger="netsuite_client"):
+        restlet.statuses = [401]
+        client.fetch_sales_data(use_cache=False)
+
+        # Un segundo 401 dentro del intervalo reintenta igualmente, pero sin regenerar la firma.
+        restlet.statuses = [401]
+        client.fetch_sales_data(use_cache=False)
+
+    assert len(restlet.auth_headers) == 4
+    assert _auth_refreshes(caplog) == 1
+
+
+def test_read_timeout_is_not_retried(restlet):
+    restlet.delay = 0.3
+    url = f"http://127.0.0.1:{restlet.server_port}/restlet"
+    with NetSuiteClient("123_SB1", "ck", "cs", "tid", "ts", restlet_url=url, timeout=0.1) as ns_client:
+        with pytest.raises(NetSuiteError, match="tardó más de 0.1 segundos"):
+            ns_client.fetch_sales_data(use_cache=False)
+    assert len(restlet.auth_headers) == 1
+
+
+def test_oversized_response_is_rejected(restlet):
+    url = f"http://127.0.0.1:{restlet.server_port}/restlet"
+    with NetSuiteClient("123_SB1", "ck", "cs", "tid", "ts", restlet_url=url, max_bytes=16) as ns_client:
+        with pytest.raises(NetSuiteError, match="tamaño máximo"):
+            ns_client.fetch_sales_data(use_cache=False)
+
+
+@pytest.mark.parametrize(
+    "codes",
+    [
+        ["SOL01", "0012", None],
+        [5, 12, None],
+        [5, 12.0, 7],
+    ],
+)
+def test_hotel_codes_keep_their_json_values(restlet, client, codes):
+    restlet.records = [
+        {"Cliente": f"Hotel {idx}", "Hotel - Code": code, "Ene 2024": 10}
+        for idx, code in enumerate(codes)
+    ]
+
+    df = client.fetch_sales_data(use_cache=False)
+
+    expected = pd.DataFrame(restlet.records)["Hotel - Code"]
+    assert df["Hotel - Code"].astype(object).where(df["Hotel - Code"].notna(), None).tolist() == (
+        expected.astype(object).where(expected.notna(), None).tolist()
+    )
+
+
+def test_arrow_frame_gives_the_same_analysis(restlet, client, make_sales_frame):
+    extra = ("Grupo Mar: Hotel Sin Datos", None, None, None, None)
+    restlet.records = make_sales_frame(extra).astype(object).where(lambda df: df.notna(), None).to_dict("records")
+
+    arrow = client.fetch_sales_data(backend="arrow")
+    numpy = client.fetch_sales_data(backend="numpy")
+
+    assert all(isinstance(dtype, pd.ArrowDtype) for dtype in arrow.dtypes if dtype != "category")
+    assert analyze_yoy_df(arrow) == analyze_yoy_df(numpy)
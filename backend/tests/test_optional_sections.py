@@ -0,0 +1,43 @@
+import pytest
+
+from app.analysis import analyze_yoy
+
+# Un hotel sin ventas en 2024: con churn_months=3 entra en churn.
+CLOSED = ("Grupo Mar: Hotel Cerrado", "MAR02", "Cancun", 80.0, 0.0)
+
+
+@pytest.fixture
+def xlsx(make_sales_frame, to_xlsx):
+    return to_xlsx(make_sales_frame(CLOSED))
+
+
+def _analyze(file_bytes, **params):
+    return analyze_yoy(file_bytes, "ventas.xlsx", churn_months=3, **params)
+
+
+def test_sections_included_by_default(xlsx):
+    result = _analyze(xlsx)
+    assert [row["Cliente"] for row in result["churn"]] == [CLOSED[0]]
+    assert result["cohorts"]["rows"]
+    assert result["meta"]["includeChurn"] is True
+    assert result["meta"]["includeCohorts"] is True
+
+
+def test_include_churn_false_skips_churn_only(xlsx):
+    full = _analyze(xlsx)
+    result = _analyze(xlsx, include_churn=False)
+    assert result["churn"] == []
+    assert result["meta"]["includeChurn"] is False
+    assert result["cohorts"] == full["cohorts"]
+    assert result["summary"] == full["summary"]
+    assert result["tables"] == full["tables"]
+
+
+def test_include_cohorts_false_skips_cohorts_only(xlsx):
+    full = _analyze(xlsx)
+    result = _analyze(xlsx, include_cohorts=False)
+    assert result["cohorts"]["rows"] == []
+    assert result["cohorts"]["columns"] == full["cohorts"]["columns"]
+    assert result["meta"]["includeCohorts"] is False
+    assert result["churn"] == full["churn"]
+    assert result["summary"] == full["summary"]
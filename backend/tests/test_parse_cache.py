@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import pytest
+
+from app import analysis
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache(monkeypatch):
+    monkeypatch.setattr(analysis, "_EXCEL_CACHE", OrderedDict())
+
+
+def test_concurrent_parses_run_once_even_after_a_failure():
+    # El primer parseo falla; los hilos que esperaban o llegan después no deben parsear a la vez.
+    state = {"calls": 0, "active": 0, "max_active": 0}
+    guard = threading.Lock()
+    parsed = object()
+
+    def parse():
+        with guard:
+            state["calls"] += 1
+            state["active"] += 1
+            state["max_active"] = max(state["max_active"], state["active"])
+            first = state["calls"] == 1
+        time.sleep(0.05)
+        with guard:
+            state["active"] -= 1
+        if first:
+            raise ValueError("cabecera no encontrada")
+        return parsed
+
+    results = []
+
+    def worker():
+        try:
+            results.append(analysis._cached_parse(b"parse-key", parse))
+        except ValueError:
+            results.append(None)
+
+    threads = []
+    for _ in range(8):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.015)
+    for thread in threads:
+        thread.join()
+
+    assert state["max_active"] == 1
+    assert state["calls"] == 2
+    assert results.count(None) == 1 and results.count(parsed) == 7
+    assert analysis._PARSE_LOCKS == {}
+
+
+def test_failed_parse_releases_its_lock():
+    def parse():
+        raise ValueError("cabecera no encontrada")
+
+    with pytest.raises(ValueError):
+        analysis._cached_parse(b"bad-key", parse)
+    assert analysis._PARSE_LOCKS == {}
+
+
+def test_analyses_leave_the_cached_frame_untouched(sales_xlsx):
+    # Cada análisis recibe una copia superficial del parseo cacheado y solo le añade columnas.
+    parsed = analysis._cached_workbook(sales_xlsx, "ventas.xlsx")
+    snapshot = parsed.df.copy(deep=True)
+
+    for mode in ("month", "ytd", "rolling3"):
+        analysis.analyze_yoy(sales_xlsx, "ventas.xlsx", mode=mode)
+    analysis.analyze_yoy(sales_xlsx, "ventas.xlsx", search="playa", impact_min=10, var_max=0)
+
+    assert analysis._cached_workbook(sales_xlsx, "ventas.xlsx") is parsed
+    pd.testing.assert_frame_equal(parsed.df, snapshot)
@@ -0,0 +1,47 @@
+from collections import OrderedDict
+
+import pytest
+
+from app import analysis
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache(monkeypatch):
+    monkeypatch.setattr(analysis, "_RESULT_CACHE", OrderedDict())
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    # Gemini simulado: registra las llamadas y devuelve en orden las respuestas (resumen, error) de replies.
+    calls = []
+    replies = []
+
+    def fake_gemini(*args):
+        calls.append(args)
+        return replies.pop(0)
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(analysis, "_build_ai_summary_gemini", fake_gemini)
+    return calls, replies
+
+
+def test_repeated_request_is_served_from_cache(sales_xlsx):
+    first = analysis.analyze_yoy_cached(sales_xlsx, "ventas.xlsx", mode="month")
+    assert first["aiSummary"]["llmFallbackReason"] == "missing_gemini_api_key"
+    assert analysis.analyze_yoy_cached(sales_xlsx, "ventas.xlsx", mode="month") is first
+
+
+def test_transient_gemini_failure_is_not_cached(sales_xlsx, gemini):
+    calls, replies = gemini
+    replies.extend([(None, "gemini_timeout"), ({"conclusions": ["ok"]}, None)])
+
+    failed = analysis.analyze_yoy_cached(sales_xlsx, "ventas.xlsx", mode="month")
+    assert failed["aiSummary"]["llmFallbackReason"] == "gemini_timeout"
+
+    retried = analysis.analyze_yoy_cached(sales_xlsx, "ventas.xlsx", mode="month")
+    assert retried["aiSummary"]["llmFallbackReason"] is None
+    assert retried["aiSummary"]["conclusions"] == ["ok"]
+
+    # El resumen bueno sí queda en caché: no hay una tercera llamada a Gemini.
+    assert analysis.analyze_yoy_cached(sales_xlsx, "ventas.xlsx", mode="month") is retried
+    assert len(calls) == 2
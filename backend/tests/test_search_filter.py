@@ -0,0 +1,38 @@
+import pytest
+
+from app.analysis import analyze_yoy
+
+# Ventas de marzo 2023 por hotel (conftest): identifican qué filas pasan el filtro.
+PLAYA, CENTRO, PLAYA_NORTE = 100.0, 200.0, 400.0
+
+
+def _total_prev(file_bytes: bytes, search: str) -> float:
+    return analyze_yoy(file_bytes, "ventas.xlsx", search=search)["summary"]["totalPrev"]
+
+
+def test_single_term_is_a_substring_match(sales_xlsx):
+    assert _total_prev(sales_xlsx, "play") == PLAYA + PLAYA_NORTE
+
+
+def test_all_terms_must_match(sales_xlsx):
+    assert _total_prev(sales_xlsx, "playa sol") == PLAYA
+
+
+def test_term_order_does_not_matter(sales_xlsx):
+    assert _total_prev(sales_xlsx, "sol playa") == _total_prev(sales_xlsx, "playa sol")
+
+
+@pytest.mark.parametrize(
+    ("search", "expected"),
+    [("CANCUN", PLAYA_NORTE), ("mar01", PLAYA_NORTE), ("  Centro  ", CENTRO)],
+)
+def test_matches_location_and_code_case_insensitively(sales_xlsx, search, expected):
+    assert _total_prev(sales_xlsx, search) == expected
+
+
+def test_terms_are_literal_not_regex(sales_xlsx):
+    assert _total_prev(sales_xlsx, "playa.*") == 0.0
+
+
+def test_unmatched_term_filters_everything(sales_xlsx):
+    assert _total_prev(sales_xlsx, "playa lisboa") == 0.0